@@ -0,0 +1,177 @@
+# backend/app/agents/artifacts.py
+import difflib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 大块文本 (专家情报、行程草稿) 不直接放进 State，而是存一份到 Artifact Store，State 里只放引用 ID
+# LangGraph 每一步都要复制/合并 State，checkpointer 每一步都要序列化一遍；
+# 换成几十字节的引用后，这些开销和文本长短无关了
+#
+# - 按内容寻址：ID = 内容的哈希，同样的情报 (同城天气、同一家酒店列表) 只存一份
+# - 存在 SQLite (ARTIFACT_DB_PATH)，和会话一样重启不丢，续聊时还能取回上一轮的情报
+# - 超过 ARTIFACT_TTL_DAYS 没被用过 (写入或续聊时检查) 的条目由后台线程定期清理；
+#   会话引用的条目被清掉后，续聊会沿用会话里的需求重新查情报 (见 graph.entry_condition)
+
+ARTIFACT_DB_PATH = os.getenv("ARTIFACT_DB_PATH", "./artifacts.db")
+ARTIFACT_TTL_DAYS = float(os.getenv("ARTIFACT_TTL_DAYS", "7"))
+ARTIFACT_CACHE_ENTRIES = int(os.getenv("ARTIFACT_CACHE_ENTRIES", "512"))
+ARTIFACT_PRUNE_INTERVAL = float(os.getenv("ARTIFACT_PRUNE_INTERVAL", "3600"))
+
+# 同一条目在这段时间内只刷新一次使用时间 (TTL 以天计，不必每次写库)
+_TOUCH_INTERVAL = 600
+
+REF_PREFIX = "artifact:"
+
+def is_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+# ==========================================
+# 1. Artifact Store
+# ==========================================
+class ArtifactStore:
+    def __init__(self, path: str, cache_entries: int = 512):
+        # 一条共享连接 (check_same_thread=False，同 checkpoint.py)：写入很少，加锁串行即可；
+        # ":memory:" 也能用 (每个线程各开连接的话会各是一个空库)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # ref -> (内容, 上次刷新使用时间)；命中就不用查库
+        self._cache_entries = cache_entries
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            # created_at 实际记录的是最近一次使用时间 (清理按它判断)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (id TEXT PRIMARY KEY, content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def put(self, content: Optional[str]) -> Optional[str]:
+        """存入一段文本，返回引用 ID (None 原样返回)"""
+        if content is None:
+            return None
+        ref = REF_PREFIX + hashlib.sha1(content.encode("utf-8")).hexdigest()[:20]
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(ref)
+            if cached is None or now - cached[1] > _TOUCH_INTERVAL:
+                # 已经存在就只刷新时间 (按内容寻址，内容一定相同)
+                self._conn.execute(
+                    "INSERT INTO artifacts (id, content, created_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET created_at = excluded.created_at",
+                    (ref, content, now)
+                )
+                cached = (content, now)
+            self._remember(ref, cached)
+        return ref
+
+    def get(self, ref: str) -> Optional[str]:
+        with self._lock:
+            cached = self._cache.get(ref)
+            if cached is None:
+                row = self._conn.execute("SELECT content, created_at FROM artifacts WHERE id = ?", (ref,)).fetchone()
+                if row is None:
+                    return None
+                cached = (row[0], row[1])
+            self._remember(ref, cached)
+            return cached[0]
+
+    def available(self, *values) -> bool:
+        """
+        State 里的这些值是否都还能取到 (不是引用的直接算可用)，同时刷新它们的使用时间，
+        让还在续聊的会话引用的条目不会被清理
+        """
+        refs = {v for v in values if is_ref(v)}
+        if not refs:
+            return True
+        placeholders = ",".join("?" * len(refs))
+        with self._lock:
+            touched = self._conn.execute(
+                f"UPDATE artifacts SET created_at = ? WHERE id IN ({placeholders})", (time.time(), *refs)
+            ).rowcount
+        return touched == len(refs)
+
+    def resolve(self, value):
+        """State 里的值 -> 文本：引用就取出内容；老会话里直接存的文本原样返回"""
+        if not is_ref(value):
+            return value
+        content = self.get(value)
+        if content is None:
+            logger.warning("引用的内容已过期或不存在: %s", value)
+        return content
+
+    def prune(self, max_age_seconds: float):
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM artifacts WHERE created_at < ?", (time.time() - max_age_seconds,)
+            ).rowcount
+            # 缓存里的也可能已经被删掉 (以及记录的刷新时间不再可信)
+            self._cache.clear()
+        if deleted:
+            logger.info("清理过期 Artifact %s 条", deleted)
+
+    def _remember(self, ref, cached):
+        self._cache[ref] = cached
+        self._cache.move_to_end(ref)
+        while len(self._cache) > self._cache_entries:
+            self._cache.popitem(last=False)
+
+def _prune_loop(store: ArtifactStore):
+    """长时间运行的进程里定期清理，库不会无限增长"""
+    while True:
+        try:
+            store.prune(ARTIFACT_TTL_DAYS * 86400)
+        except Exception as e:
+            logger.warning("清理 Artifact 失败: %s", e)
+        time.sleep(ARTIFACT_PRUNE_INTERVAL)
+
+artifacts = ArtifactStore(ARTIFACT_DB_PATH, ARTIFACT_CACHE_ENTRIES)
+threading.Thread(target=_prune_loop, args=(artifacts,), name="artifact-prune", daemon=True).start()
+
+# ==========================================
+# 2. 草稿历史 (只存差异)
+# ==========================================
+# 规划师每重写一次，当前草稿以完整内容存为 Artifact，被替换掉的旧草稿只记一份
+# "新 -> 旧" 的反向差异 (按行)。Critic 打回后的重写通常只改几行，差异比整份草稿小得多。
+
+def make_diff(new: str, old: str) -> list:
+    """生成把 new 变回 old 的差异: [[起始行, 结束行, [替换成的行...]], ...]"""
+    new_lines, old_lines = new.splitlines(keepends=True), old.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False)
+    return [[i1, i2, old_lines[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+def apply_diff(new: str, diff: list) -> str:
+    lines = new.splitlines(keepends=True)
+    # 从后往前替换，前面的行号不受影响
+    for start, end, replacement in reversed(diff):
+        lines[start:end] = replacement
+    return "".join(lines)
+
+def record_draft(state: dict, new_draft: str, node: str, reason: Optional[str] = None) -> dict:
+    """
+    规划节点产出新草稿时调用，返回要写回 State 的字段：
+    draft_plan = 新草稿的引用；draft_history 追加 旧草稿 相对 新草稿 的差异
+    reason: 为什么重写 (审核意见 / 用户的修改要求)
+    """
+    history = list(state.get("draft_history") or [])
+    previous = artifacts.resolve(state.get("draft_plan"))
+    if previous and previous != new_draft:
+        history.append({"node": node, "reason": reason, "diff": make_diff(new_draft, previous)})
+    return {"draft_plan": artifacts.put(new_draft), "draft_history": history}
+
+def draft_versions(state: dict) -> List[str]:
+    """还原所有历史草稿，最新的在前"""
+    current = artifacts.resolve(state.get("draft_plan"))
+    if not current:
+        return []
+    versions = [current]
+    for entry in reversed(state.get("draft_history") or []):
+        versions.append(apply_diff(versions[-1], entry["diff"]))
+    return versions
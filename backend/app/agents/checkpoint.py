@@ -0,0 +1,31 @@
+# backend/app/agents/checkpoint.py
+import os
+import sqlite3
+
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 会话记忆 (Checkpointer)：按 session_id 保存每轮对话结束时的完整 State
+# 这样用户说 "把第二天下午换成购物" 时，天气/景点/酒店情报都还在，不用重新查
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.db")
+
+# 尝试使用 SQLite 持久化会话，如果没装 langgraph-checkpoint-sqlite 就降级为内存版
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    # check_same_thread=False: FastAPI 会在不同线程里调用 Graph
+    _conn = sqlite3.connect(SESSION_DB_PATH, check_same_thread=False)
+    checkpointer = SqliteSaver(_conn)
+    logger.info("会话存储已启用 SQLite: %s", SESSION_DB_PATH)
+except ImportError as e:
+    from langgraph.checkpoint.memory import MemorySaver
+
+    checkpointer = MemorySaver()
+    logger.warning("未安装 SQLite Checkpointer (%s)，降级使用内存会话 (重启后丢失)", e)
+
+
+def session_config(session_id: str) -> dict:
+    """生成 Graph 调用配置：同一个 session_id 共享同一份 State"""
+    return {"configurable": {"thread_id": session_id}}
@@ -0,0 +1,82 @@
+# backend/app/agents/fast_path.py
+from datetime import datetime
+from typing import Annotated, TypedDict
+
+from langgraph.errors import GraphRecursionError
+from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
+
+from app.services.mcp import mcp_service
+from app.services.llm_gateway import llm_gateway, TIER_FAST
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 快速通道：沿用 simple_agent.py 的 "一个 LLM + 工具" ReAct 循环
+# 工具来自同一个 MCP 服务 (同样带缓存)，LLM 走网关的 fast 档
+
+# 最多几轮 "思考 -> 调工具"，防止简单问题绕圈子
+MAX_STEPS = 8
+
+class FastState(TypedDict):
+    messages: Annotated[list, add_messages]
+
+tools = mcp_service.get_tools()
+llm_with_tools = llm_gateway.bind_tools(tools, tier=TIER_FAST)
+
+def assistant_node(state: FastState):
+    # 注入当前日期，AI 才知道"明天"是几号
+    current_date = datetime.now().strftime("%Y-%m-%d %A")
+    system_prompt = SystemMessage(content=(
+        f"你是智能旅行助手。今天是 {current_date}。"
+        "请简洁地回答用户的问题：查天气用 get_weather，本地推荐优先用 search_local_guide，其余用 search_tavily。"
+    ))
+    response = llm_with_tools.invoke([system_prompt] + state["messages"])
+    return {"messages": [response]}
+
+def should_continue(state: FastState):
+    last_message = state["messages"][-1]
+    if getattr(last_message, "tool_calls", None):
+        return "tools"
+    return END
+
+workflow = StateGraph(FastState)
+workflow.add_node("assistant", assistant_node)
+workflow.add_node("tools", ToolNode(tools))
+
+workflow.set_entry_point("assistant")
+workflow.add_conditional_edges("assistant", should_continue, ["tools", END])
+workflow.add_edge("tools", "assistant")
+
+fast_graph = workflow.compile()
+
+# 步数用完还没答出来时的回复
+FALLBACK_REPLY = "抱歉，这个问题没能很快查到答案。可以换个更具体的问法，或者让我帮你规划完整的行程。"
+
+def _text_of(content) -> str:
+    # Gemini 有时返回分段内容 [{"type": "text", "text": ...}]
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+def run_fast_path(message: str) -> str:
+    """跑一次快速通道，返回最终回答文本"""
+    messages = []
+    try:
+        # 逐步拿到 State：超过 MAX_STEPS 时手里还有之前的消息
+        for state in fast_graph.stream(
+            {"messages": [HumanMessage(content=message)]},
+            {"recursion_limit": MAX_STEPS},
+            stream_mode="values"
+        ):
+            messages = state["messages"]
+    except GraphRecursionError:
+        # 一直在调工具：用助手最后说过的话 (调工具前常会先答一部分)，一句都没有就给兜底回复
+        logger.warning("快速通道超过 %s 步仍未结束", MAX_STEPS)
+        for msg in reversed(messages):
+            if isinstance(msg, AIMessage) and _text_of(msg.content).strip():
+                return _text_of(msg.content)
+        return FALLBACK_REPLY
+    return _text_of(messages[-1].content)
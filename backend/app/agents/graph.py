@@ -1,30 +1,79 @@
 # backend/app/agents/graph.py
 from langgraph.graph import StateGraph, END
 from app.agents.state import AgentState
+from app.agents.checkpoint import checkpointer
+from app.agents.artifacts import artifacts
+from app.services.tracing import traced
+from app.services.log import get_logger
 from app.agents.nodes import (
     extractor_node,
     weather_node,
     attraction_node,
     hotel_node,
     planner_node,
-    critic_node
+    critic_node,
+    followup_node,
+    replanner_node
 )
 
+logger = get_logger(__name__)
+
 # 1. 初始化图
 workflow = StateGraph(AgentState)
 
 # 2. 添加节点 (也就是我们的 5 个 Agent + 1 个提取器)
-workflow.add_node("extractor", extractor_node)       # 入口：意图识别
-workflow.add_node("weather_agent", weather_node)     # 专家：天气
-workflow.add_node("attraction_agent", attraction_node) # 专家：景点
-workflow.add_node("hotel_agent", hotel_node)         # 专家：酒店
-workflow.add_node("planner", planner_node)           # 核心：规划师
-workflow.add_node("critic", critic_node)             # 核心：审核员
+# traced: 开了追踪的请求会给每个节点记一个 Span (没开时零开销直通)
+workflow.add_node("extractor", traced("extractor")(extractor_node))               # 入口：意图识别
+workflow.add_node("weather_agent", traced("weather_agent")(weather_node))         # 专家：天气
+workflow.add_node("attraction_agent", traced("attraction_agent")(attraction_node)) # 专家：景点
+workflow.add_node("hotel_agent", traced("hotel_agent")(hotel_node))               # 专家：酒店
+workflow.add_node("planner", traced("planner")(planner_node))                     # 核心：规划师
+workflow.add_node("critic", traced("critic")(critic_node))                        # 核心：审核员
+workflow.add_node("followup", traced("followup")(followup_node))                  # 续聊：判断是改行程还是新行程
+workflow.add_node("replanner", traced("replanner")(replanner_node))               # 续聊：局部重规划
 
 # 3. 定义边 (连接逻辑)
 
-# [第一阶段] 入口 -> 提取 -> 并行分发
-workflow.set_entry_point("extractor")
+# [第零阶段] 入口分流
+# 同一会话里已经有行程了 -> 先判断续聊意图；否则是全新的请求 -> 提取
+# 批量接口直接给出结构化的 TripRequest (没有聊天消息) -> 跳过提取，直接分发给三个专家
+EXPERT_NODES = ["weather_agent", "attraction_agent", "hotel_agent"]
+
+# 续聊要用到的会话情报 (Artifact 引用)
+SESSION_ARTIFACTS = ("draft_plan", "weather_info", "attractions_info", "hotels_info")
+
+def entry_condition(state: AgentState):
+    if state.get("draft_plan") and state.get("request"):
+        if artifacts.available(*(state.get(key) for key in SESSION_ARTIFACTS)):
+            return "followup"
+        # 会话太久没用，引用的情报/草稿已被清理：不能在 "None" 上局部修改。
+        # 续聊的话 ("把第二天下午换成购物") 里通常没有城市/日期，不能重新提取；
+        # 沿用会话里的 TripRequest 重新查情报，规划师会把这句话当作额外要求
+        logger.warning("会话引用的情报已过期，沿用原需求重新查情报", extra={"city": state["request"].city})
+        return EXPERT_NODES
+    if state.get("request") and not state.get("messages"):
+        return EXPERT_NODES
+    return "extractor"
+
+workflow.set_conditional_entry_point(
+    entry_condition,
+    {"followup": "followup", "extractor": "extractor", **{node: node for node in EXPERT_NODES}}
+)
+
+# 续聊：同城同日期的修改只重跑规划师 (1~2 次 LLM 调用)，否则走完整流程
+def followup_condition(state: AgentState):
+    if state.get("followup_type") == "edit":
+        return "replanner"
+    return "extractor"
+
+workflow.add_conditional_edges(
+    "followup",
+    followup_condition,
+    {"replanner": "replanner", "extractor": "extractor"}
+)
+workflow.add_edge("replanner", END)
+
+# [第一阶段] 提取 -> 并行分发
 
 # 提取完信息后，同时把任务扔给三个专家 (Fan-out)
 # LangGraph 中，只要添加多条边，它们就会并行运行！
@@ -50,11 +99,11 @@ def critic_condition(state: AgentState):
     
     # 如果包含 FAIL 且重试次数不超过 3 次 -> 打回 Planner
     if "FAIL" in comment and count <= 3:
-        print(f"🔄 [Loop] 审核未通过，打回重写 (第 {count} 次)...")
+        logger.info("审核未通过，打回重写 (第 %s 次)", count)
         return "planner"
     else:
         # 通过，或者重试太多次了，强制结束
-        print("✅ [Finish] 流程结束")
+        logger.info("流程结束")
         return END
 
 # 把逻辑挂载到 Critic 节点上
@@ -69,4 +118,8 @@ workflow.add_conditional_edges(
 
 # 5. 编译图
 # 这就是我们要导出的 App，之后前端就是调用它
-graph = workflow.compile()
\ No newline at end of file
+# 挂上 checkpointer 后，调用时必须传 session_config(session_id)
+graph = workflow.compile(checkpointer=checkpointer)
+
+# 批量任务用的版本：每个行程只跑一次、不需要续聊，不写会话库
+batch_graph = workflow.compile()
\ No newline at end of file
@@ -1,35 +1,65 @@
 # backend/app/agents/nodes.py
-import os
 import json
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 # 1. 导入数据模型 (Schema)
 from app.models.schemas import TripRequest
 
 # 2. 导入状态定义 (State)
 from app.agents.state import AgentState
+from app.agents.plan_parser import parse_trip_plan
+# 大块文本 (情报、草稿) 存进 Artifact Store，State 里只放引用
+from app.agents.artifacts import artifacts, record_draft
 
 # 3. 导入 MCP 服务 (这是唯一的工具来源)
 from app.services.mcp import mcp_service
 
+# 4. 导入 LLM 网关 (多 Key/多模型、对冲请求、配额熔断都在里面)
+from app.services.llm_gateway import llm_gateway, TIER_FAST
+from app.tools.result import ToolResult
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
 # ==========================================
 # 初始化配置
 # ==========================================
 
 # 1. 准备大脑 (LLM)
-llm = ChatGoogleGenerativeAI(
-    model=os.getenv("LLM_MODEL_ID", "gemini-1.5-flash"),
-    temperature=0,
-    google_api_key=os.getenv("LLM_API_KEY")
-)
+# 所有节点共用一个网关；提取/审核这类简单任务传 tier=TIER_FAST 走更快的模型
+llm = llm_gateway
 
 # 2. 准备工具箱 (从 MCP 服务获取)
 # 我们把工具列表转换成字典，方便通过名字调用: tools_map['get_weather']
 tools = mcp_service.get_tools()
 tools_map = {t.name: t for t in tools}
 
-print(f"🔧 [Nodes] 已连接 MCP 服务，可用工具: {list(tools_map.keys())}")
+logger.info("已连接 MCP 服务", extra={"tools": list(tools_map.keys())})
+
+def tool_text(result, fallback: str) -> str:
+    """工具返回 -> 给 LLM 的文本：失败或空结果用兜底文案，不把报错原样塞进 Prompt"""
+    if isinstance(result, ToolResult) and (not result.ok or result.empty):
+        return fallback
+    return str(result)
+
+# 3. 行程 JSON 格式 (对应 app/models/schemas.py 里的 TripPlan)
+# 规划师按这个结构输出，后端就能边生成边逐天解析、推送给前端
+PLAN_JSON_FORMAT = """
+{"city": "Hamilton", "duration": 2, "summary": "整趟旅程的总结建议",
+ "days": [
+  {"day_index": 1, "date": "2026-03-10", "city": "Hamilton",
+   "weather": {"date": "2026-03-10", "condition": "晴", "temp": "5~12°C"},
+   "attractions": [{"name": "景点名", "description": "推荐理由", "visit_duration": 90, "ticket_price": 0}],
+   "meals": [{"name": "餐厅名", "type": "午餐", "description": "推荐理由"}],
+   "hotel": {"name": "酒店名", "price_range": "中等"},
+   "daily_summary": "当日行程小结",
+   "route_segments": [
+     {"type": "place", "name": "景点名", "description": "一句话介绍", "emoji": "🏞️"},
+     {"type": "transport", "mode": "walk", "duration": "15 min", "instruction": "接驳说明"}
+   ]}
+ ],
+ "total_budget": {"total": 1500, "breakdown": "费用明细"}}
+"""
 
 # ==========================================
 # 节点 1: 意图提取 (Extractor)
@@ -39,16 +69,17 @@ def extractor_node(state: AgentState):
     入口节点：把用户的自然语言转成结构化的 TripRequest
     """
     last_msg = state['messages'][-1].content
-    print(f"👂 [Extractor] 分析用户需求: {last_msg}")
+    # 用户原话只在 DEBUG 级别输出
+    logger.debug("分析用户需求: %s", last_msg)
     
     prompt = f"""
-    请从用户的话中提取：目的地(city)、日期(date_range)、兴趣(interests)。
-    返回 JSON 格式，例如: {{"city": "Paris", "date_range": "3 days", "interests": "food"}}
+    请从用户的话中提取：目的地(city)、日期(date_range)、兴趣(interests)、交通偏好(transport_mode，只能是 walk/transit/taxi，没提到就用 transit)。
+    返回 JSON 格式，例如: {{"city": "Paris", "date_range": "3 days", "interests": "food", "transport_mode": "walk"}}
     用户输入: {last_msg}
     """
     
     try:
-        response = llm.invoke(prompt)
+        response = llm.invoke(prompt, tier=TIER_FAST)
         # 清洗 JSON (去掉 Markdown 标记)
         content = response.content.replace("```json", "").replace("```", "").strip()
         data = json.loads(content)
@@ -58,42 +89,47 @@ def extractor_node(state: AgentState):
             city=data.get("city", "Hamilton"), # 默认值容错
             days=3,
             date_range=data.get("date_range", "近期"),
-            interests=data.get("interests", "当地特色")
+            interests=data.get("interests", "当地特色"),
+            transport_mode=data.get("transport_mode") if data.get("transport_mode") in ("walk", "transit", "taxi") else "transit"
         )
-        return {"request": request}
     except Exception as e:
-        print(f"⚠️ 解析失败，使用默认参数: {e}")
-        return {"request": TripRequest(city="Hamilton", days=3, date_range="近期", interests="General")}
+        logger.warning("需求解析失败，使用默认参数: %s", e)
+        request = TripRequest(city="Hamilton", days=3, date_range="近期", interests="General")
+
+    # 新行程：清空上一轮 (同一会话) 留下的草稿和审核记录
+    return {"request": request, "draft_plan": None, "draft_history": [], "critique_comments": None,
+            "critique_count": 0, "final_plan": None}
 
 # ==========================================
 # 节点 2: 天气专家 (Weather Agent)
 # ==========================================
 def weather_node(state: AgentState):
     request = state['request']
-    print(f"🌤️ [WeatherAgent] 正在调用 MCP 工具查询 {request.city} 天气...")
+    logger.info("查询天气", extra={"city": request.city})
     
     # --- MCP 标准化调用 ---
     # 我们不关心 get_weather 内部是 OpenWeather 还是 Yahoo，直接调
     try:
         tool = tools_map["get_weather"]
-        result = tool.invoke({"city": request.city})
+        result = tool_text(tool.invoke({"city": request.city}), "天气查询失败，请按常规天气安排")
     except Exception as e:
         result = f"查询错误: {e}"
         
-    return {"weather_info": str(result)}
+    return {"weather_info": artifacts.put(result)}
 
 # ==========================================
 # 节点 3: 景点专家 (Attraction Agent)
 # ==========================================
 def attraction_node(state: AgentState):
     request = state['request']
-    print(f"🏰 [AttractionAgent] 正在调用 MCP 工具搜索 {request.interests}...")
+    logger.info("搜索景点", extra={"city": request.city})
     
     # 1. 调用 RAG 工具 (独家数据)
     try:
         rag_tool = tools_map["search_local_guide"]
+        # 只在目的地城市的分区里检索；知识库没有这个城市时直接返回空
         rag_query = f"{request.city} {request.interests}"
-        rag_data = rag_tool.invoke(rag_query)
+        rag_data = tool_text(rag_tool.invoke({"query": rag_query, "city": request.city}), "暂无本地独家情报")
     except Exception as e:
         rag_data = "暂无本地独家情报"
 
@@ -101,34 +137,34 @@ def attraction_node(state: AgentState):
     try:
         web_tool = tools_map["search_tavily"]
         web_query = f"top tourist attractions in {request.city} for {request.interests}"
-        web_data = web_tool.invoke(web_query)
+        web_data = tool_text(web_tool.invoke(web_query), "网络搜索失败")
     except Exception as e:
         web_data = "网络搜索失败"
     
     summary = f"【独家本地情报】\n{rag_data}\n\n【网络热门推荐】\n{web_data}"
-    return {"attractions_info": summary}
+    return {"attractions_info": artifacts.put(summary)}
 
 # ==========================================
 # 节点 4: 酒店专家 (Hotel Agent)
 # ==========================================
 def hotel_node(state: AgentState):
     request = state['request']
-    print(f"🏨 [HotelAgent] 正在调用 MCP 工具查询酒店...")
+    logger.info("查询酒店", extra={"city": request.city})
     
     try:
         tool = tools_map["search_tavily"]
         query = f"recommended hotels in {request.city} safe area price range mid"
-        result = tool.invoke(query)
+        result = tool_text(tool.invoke(query), "酒店查询失败")
     except Exception as e:
         result = "酒店查询失败"
         
-    return {"hotels_info": str(result)}
+    return {"hotels_info": artifacts.put(result)}
 
 # ==========================================
 # 节点 5: 总规划师 (Planner Agent)
 # ==========================================
 def planner_node(state: AgentState):
-    print("📝 [PlannerAgent] 正在撰写行程草稿...")
+    logger.info("撰写行程草稿", extra={"round": state.get("critique_count", 0)})
     
     # 汇总上下文
     context = f"""
@@ -136,14 +172,15 @@ def planner_node(state: AgentState):
     目的地: {state['request'].city}
     日期: {state['request'].date_range}
     偏好: {state['request'].interests}
+    用户最新的话: {state['messages'][-1].content if state.get('messages') else '无'}
     
     【情报汇总】
-    1. 天气: {state.get('weather_info')}
-    2. 景点: {state.get('attractions_info')}
-    3. 酒店: {state.get('hotels_info')}
+    1. 天气: {artifacts.resolve(state.get('weather_info'))}
+    2. 景点: {artifacts.resolve(state.get('attractions_info'))}
+    3. 酒店: {artifacts.resolve(state.get('hotels_info'))}
     
     【审核历史】
-    {state.get('critique_comments', '无')}
+    {state.get('critique_comments') or '无'}
     """
     
     prompt = f"""
@@ -154,20 +191,34 @@ def planner_node(state: AgentState):
     2. 深度体验：**必须**优先包含【独家本地情报】中的推荐。
     3. 完整性：必须包含推荐的酒店。
     4. 修正：如果【审核历史】中有批评意见，必须针对性修改。
+    5. 路线：route_segments 中地点 (place) 与交通 (transport) 交替出现。
     
-    请直接输出行程内容，不要有多余的寒暄。
+    请只输出一个 JSON 对象，按天顺序排列 days，不要有多余的寒暄。格式如下：
+    {PLAN_JSON_FORMAT}
     """
     
     response = llm.invoke([SystemMessage(content=context), HumanMessage(content=prompt)])
-    return {"draft_plan": response.content}
+    # 新草稿还没审核：上一轮 (同一会话) 留下的成品作废
+    draft = record_draft(state, response.content, "planner", state.get("critique_comments"))
+    return {**draft, "final_plan": None}
 
 # ==========================================
 # 节点 6: 审核员 (Critic Agent)
 # ==========================================
 def critic_node(state: AgentState):
-    print("🧐 [CriticAgent] 正在审核行程...")
+    logger.info("审核行程")
     
-    plan = state.get('draft_plan', "")
+    plan = artifacts.resolve(state.get('draft_plan')) or ""
+    
+    # 先做结构校验：JSON 都解析不了就不用浪费一次 LLM 调用了
+    try:
+        trip_plan = parse_trip_plan(plan)
+    except Exception as e:
+        logger.warning("行程 JSON 格式错误: %s", e)
+        return {
+            "critique_comments": f"FAIL: 输出不是合法的行程 JSON ({e})，请严格按格式输出",
+            "critique_count": state.get("critique_count", 0) + 1
+        }
     
     prompt = f"""
     请审核以下旅行计划。
@@ -184,19 +235,96 @@ def critic_node(state: AgentState):
     {plan}
     """
     
-    response = llm.invoke(prompt)
+    response = llm.invoke(prompt, tier=TIER_FAST)
     comment = response.content.strip()
     
     if "FAIL" in comment:
-        print(f"❌ [Critic] 驳回: {comment}")
+        logger.info("审核驳回: %s", comment)
         return {
             "critique_comments": comment,
             "critique_count": state.get("critique_count", 0) + 1
         }
     else:
-        print("✅ [Critic] 通过")
+        logger.info("审核通过")
         return {
             "critique_comments": "PASS",
-            # 在真实项目中，这里会调用 Structured Output 转成 TripPlan 对象
-            # 这里简化处理，直接结束
-        }
\ No newline at end of file
+            "final_plan": trip_plan
+        }
+
+# ==========================================
+# 节点 7: 续聊分类 (Follow-up Classifier)
+# ==========================================
+def followup_node(state: AgentState):
+    """
+    会话续聊入口：判断用户是在修改现有行程，还是换了一趟新旅行
+    """
+    last_msg = state['messages'][-1].content
+    request = state['request']
+    logger.debug("分析续聊意图: %s", last_msg)
+
+    prompt = f"""
+    用户已有一份行程：目的地 {request.city}，日期 {request.date_range}。
+    现在用户又说: {last_msg}
+
+    请判断：
+    - 如果只是修改现有行程的某部分 (换景点、调整时间、换酒店等)，type 为 "edit"；
+    - 如果目的地或日期变了，type 为 "new_trip"。
+    返回 JSON 格式，例如: {{"type": "edit", "city": "{request.city}", "date_range": "{request.date_range}", "sections": "第二天下午"}}
+    """
+
+    try:
+        response = llm.invoke(prompt, tier=TIER_FAST)
+        content = response.content.replace("```json", "").replace("```", "").strip()
+        data = json.loads(content)
+
+        # 双保险：即使 LLM 说是 edit，城市或日期变了也必须重新查情报
+        same_city = data.get("city", request.city).strip().lower() == request.city.strip().lower()
+        same_dates = str(data.get("date_range", request.date_range)).strip() == str(request.date_range).strip()
+        if data.get("type") == "edit" and same_city and same_dates:
+            return {"followup_type": "edit", "edit_sections": data.get("sections", "")}
+    except Exception as e:
+        logger.warning("续聊意图解析失败，按新行程处理: %s", e)
+
+    return {"followup_type": "new_trip", "edit_sections": None}
+
+# ==========================================
+# 节点 8: 增量重规划 (Replanner)
+# ==========================================
+def replanner_node(state: AgentState):
+    """
+    复用会话里缓存的天气/景点/酒店情报，只重写用户点名修改的部分
+    """
+    logger.info("局部修改行程", extra={"sections": state.get("edit_sections") or "未指明"})
+
+    context = f"""
+    【当前行程】
+    {artifacts.resolve(state.get('draft_plan'))}
+
+    【情报汇总】
+    1. 天气: {artifacts.resolve(state.get('weather_info'))}
+    2. 景点: {artifacts.resolve(state.get('attractions_info'))}
+    3. 酒店: {artifacts.resolve(state.get('hotels_info'))}
+    """
+
+    prompt = f"""
+    用户对行程提出了修改: {state['messages'][-1].content}
+    需要修改的部分: {state.get('edit_sections') or '根据用户的话自行判断'}
+
+    要求：
+    1. 只修改上述部分，其余内容保持原样、逐字保留。
+    2. 新安排的内容优先使用【情报汇总】中的信息，并符合天气情况。
+
+    请只输出修改后的完整行程 JSON (格式与【当前行程】相同)，不要有多余的寒暄。
+    """
+
+    response = llm.invoke([SystemMessage(content=context), HumanMessage(content=prompt)])
+
+    try:
+        trip_plan = parse_trip_plan(response.content)
+    except Exception as e:
+        logger.warning("修改后的行程 JSON 解析失败: %s", e)
+        trip_plan = None
+
+    # 局部修改不再走审核循环，直接视为通过
+    draft = record_draft(state, response.content, "replanner", state['messages'][-1].content)
+    return {**draft, "critique_comments": "PASS", "final_plan": trip_plan}
\ No newline at end of file
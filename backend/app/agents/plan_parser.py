@@ -0,0 +1,162 @@
+# backend/app/agents/plan_parser.py
+import json
+from typing import List, Optional
+
+from app.models.schemas import DayPlan, TripPlan
+from app.services.tracing import span
+
+# ==========================================
+# 1. 一次性解析 (完整文本 -> TripPlan)
+# ==========================================
+def clean_json_text(text: str) -> str:
+    """去掉 Markdown 代码块标记，只保留最外层 {...}"""
+    text = text.replace("```json", "").replace("```", "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end == -1:
+        return text
+    return text[start:end + 1]
+
+def parse_trip_plan(text: str) -> TripPlan:
+    """把规划师输出的 JSON 转成 TripPlan (格式不对会抛异常)"""
+    with span("parse_trip_plan", "parse", input_bytes=len(text or "")):
+        return TripPlan.model_validate(json.loads(clean_json_text(text)))
+
+# ==========================================
+# 2. 增量解析 (流式 token -> 逐天产出)
+# ==========================================
+class _Container:
+    """解析栈里的一层 {} 或 []"""
+    __slots__ = ("kind", "key", "index", "start", "expect_key", "pending_key", "count")
+
+    def __init__(self, kind, key, index, start):
+        self.kind = kind          # "{" 或 "["
+        self.key = key            # 在父对象里的字段名；父级是数组时为 "[]"
+        self.index = index        # 在父数组里的下标
+        self.start = start        # 左括号在文本中的位置
+        self.expect_key = kind == "{"
+        self.pending_key = None   # 对象里最近读到的字段名
+        self.count = 0            # 数组里已经出现过的元素数 (按逗号计)
+
+class IncrementalPlanParser:
+    """
+    增量解析 LLM 流式输出的 TripPlan JSON。
+    不等整份 JSON 结束：每当 days[i] 或 days[i].route_segments[j] 的右括号到达，
+    就立刻产出对应事件，前端可以先渲染第 1 天，第 3 天还在生成。
+
+    产出的事件:
+        {"type": "segment", "day": 1, "index": 0, "segment": {...}}
+        {"type": "day", "day": 1, "plan": DayPlan}
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+
+    def feed(self, chunk: str) -> list:
+        """喂入一段新 token，返回这段 token 中完成的事件"""
+        events = []
+        offset = len(self.text)
+        self.text += chunk
+
+        for i in range(offset, len(self.text)):
+            if self.done:
+                break
+            c = self.text[i]
+
+            # --- 字符串内部：只关心转义和结束引号 ---
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    top = self._stack[-1]
+                    if top.kind == "{" and top.expect_key:
+                        top.pending_key = json.loads(self.text[self._string_start:i + 1])
+                continue
+
+            # 最外层 { 之前的内容 (```json 之类) 全部跳过
+            if not self._stack:
+                if c == "{":
+                    self._stack.append(_Container("{", None, 0, i))
+                continue
+
+            top = self._stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                if top.kind == "{":
+                    key, index = top.pending_key, 0
+                else:
+                    key, index = "[]", top.count
+                self._stack.append(_Container(c, key, index, i))
+            elif c == ":":
+                top.expect_key = False
+            elif c == ",":
+                if top.kind == "{":
+                    top.expect_key = True
+                    top.pending_key = None
+                else:
+                    top.count += 1
+            elif c in "}]":
+                event = self._on_close(i)
+                if event:
+                    events.append(event)
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+
+        return events
+
+    def _on_close(self, end: int) -> Optional[dict]:
+        """栈顶容器闭合：判断它是不是一天或一个路线片段"""
+        top = self._stack[-1]
+        if top.kind != "{":
+            return None
+        keys = [c.key for c in self._stack]
+
+        try:
+            # 根对象 -> days -> [i]
+            if keys[1:] == ["days", "[]"]:
+                raw = json.loads(self.text[top.start:end + 1])
+                return {"type": "day", "day": top.index + 1, "plan": DayPlan.model_validate(raw)}
+            # 根对象 -> days -> [i] -> route_segments -> [j]
+            if keys[1:] == ["days", "[]", "route_segments", "[]"]:
+                raw = json.loads(self.text[top.start:end + 1])
+                return {"type": "segment", "day": self._stack[2].index + 1, "index": top.index, "segment": raw}
+        except Exception:
+            # 单个片段格式不对就跳过，最终由 parse_trip_plan 兜底校验
+            return None
+        return None
+
+# ==========================================
+# 3. 渲染 (TripPlan -> Markdown，给聊天框用)
+# ==========================================
+def plan_to_markdown(plan: TripPlan) -> str:
+    lines = [f"# {plan.city} {plan.duration} 日行程", "", plan.summary, ""]
+    for day in plan.days:
+        lines.append(day_to_markdown(day))
+    if plan.total_budget:
+        lines.append(f"**💰 预算**: {plan.total_budget.total} ({plan.total_budget.breakdown})")
+    return "\n".join(lines)
+
+def day_to_markdown(day: DayPlan) -> str:
+    lines = [f"## 第 {day.day_index} 天 · {day.date}"]
+    if day.weather:
+        lines.append(f"🌤️ {day.weather.condition} {day.weather.temp}")
+    for spot in day.attractions:
+        lines.append(f"- **{spot.name}** ({spot.visit_duration} 分钟): {spot.description}")
+    for meal in day.meals:
+        lines.append(f"- 🍽️ {meal.type}: {meal.name}" + (f" — {meal.description}" if meal.description else ""))
+    if day.hotel:
+        lines.append(f"- 🏨 住宿: {day.hotel.name} ({day.hotel.price_range})")
+    lines.append("")
+    lines.append(day.daily_summary)
+    lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,73 @@
+# backend/app/agents/router.py
+import re
+
+from app.services.llm_gateway import llm_gateway, TIER_FAST
+from app.services.metrics import metrics
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 复杂度路由：/chat 入口先判断请求有多复杂
+#   fast: 简单事实/单工具问题 ("明天 Hamilton 天气怎么样？") -> 单 Agent 快速通道
+#   full: 完整行程规划 -> 多 Agent Graph (extractor -> 3 专家 -> planner ⇄ critic)
+
+ROUTE_FAST = "fast"
+ROUTE_FULL = "full"
+
+# 明显是要做行程的说法
+_FULL_PATTERN = re.compile(
+    r"行程|规划|安排|攻略|计划|周末|[一二两三四五六七八九十\d]+\s*[天日晚]|itinerar|\bplan(?:s|ning|ned)?\b|\btrip\b|\d+\s*days?\b",
+    re.IGNORECASE
+)
+# 明显是查一件事的说法
+# 英文关键词必须整词匹配：否则 "Copenhagen" 里的 open、"train" 里的 rain 会把完整规划误判成 fast
+_FAST_PATTERN = re.compile(
+    r"天气|气温|下雨|下雪|温度|几点|开门|营业|门票|多少钱|怎么去|在哪|推荐一[个家间]|"
+    r"\b(?:weather|temperature|rain(?:s|y|ing)?|snow(?:s|y|ing)?|open(?:s|ing)?|hours|tickets?|prices?"
+    r"|how (?:do i|to) get|where is)\b",
+    re.IGNORECASE
+)
+
+# 太长的消息通常带着很多约束，规则不敢判成 fast
+_FAST_MAX_LENGTH = 120
+
+def classify_by_rules(message: str):
+    """规则判断：能确定就返回路线，拿不准返回 None"""
+    full = bool(_FULL_PATTERN.search(message))
+    fast = bool(_FAST_PATTERN.search(message))
+    if full and not fast:
+        return ROUTE_FULL
+    if fast and not full and len(message) <= _FAST_MAX_LENGTH:
+        return ROUTE_FAST
+    return None
+
+def classify_request(message: str, use_llm: bool = True):
+    """
+    先走规则 (零成本)，拿不准再问一次 fast 档的小模型；出错一律走完整流程
+    use_llm=False: 只走规则，拿不准返回 None (准入排队之前用：调模型要等拿到名额再做)
+    """
+    route = classify_by_rules(message)
+    method = "rule"
+
+    if route is None:
+        if not use_llm:
+            return None
+        method = "llm"
+        prompt = f"""
+        判断下面的用户请求属于哪一类：
+        - FAST: 简单的事实查询或单个问题 (天气、某个景点的营业时间、推荐一家店等)
+        - FULL: 需要规划多天/多个景点的完整旅行行程
+        只回复 FAST 或 FULL。
+
+        用户请求: {message}
+        """
+        try:
+            response = llm_gateway.invoke(prompt, tier=TIER_FAST)
+            route = ROUTE_FAST if "FAST" in str(response.content).upper() else ROUTE_FULL
+        except Exception as e:
+            logger.warning("分类失败，走完整流程: %s", e)
+            route = ROUTE_FULL
+
+    metrics.inc("router_decisions_total", route=route, method=method)
+    logger.info("路由判定", extra={"route": route, "method": method})
+    return route
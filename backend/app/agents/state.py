@@ -17,16 +17,24 @@ class AgentState(TypedDict):
     
     # 3. 各路专家的调查结果 (结构化数据)
     # 这些字段会被景点、天气、酒店 Agent 并行填充
+    # 存的是 Artifact 引用 ("artifact:<hash>")，用 artifacts.resolve() 取出正文
     weather_info: Optional[str]
     attractions_info: Optional[str]
     hotels_info: Optional[str]
     
-    # 4. 规划师生成的初稿
+    # 4. 规划师生成的初稿 (同样是 Artifact 引用)
     draft_plan: Optional[str]
+    # 被替换掉的旧草稿，只存差异: [{"node", "reason", "diff"}, ...]，用 draft_versions() 还原
+    draft_history: Optional[list]
     
     # 5. 审核员的意见
     critique_comments: Optional[str]
     critique_count: int # 记录审核了几次，防止死循环
     
     # 6. 最终成品
-    final_plan: Optional[TripPlan]
\ No newline at end of file
+    final_plan: Optional[TripPlan]
+
+    # 7. 多轮会话 (续聊时由 followup 节点填写)
+    # "edit": 同城同日期的局部修改，只重跑规划师；"new_trip": 走完整流程
+    followup_type: Optional[str]
+    edit_sections: Optional[str] # 用户要改的部分，如 "第二天下午"
\ No newline at end of file
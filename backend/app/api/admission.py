@@ -0,0 +1,143 @@
+# backend/app/api/admission.py
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from app.services.metrics import metrics
+
+# 准入控制：限制同时运行的 Graph 数量，多出来的请求排队，队列满了就快速拒绝
+# 避免流量高峰把 Gemini / Tavily 的配额一起打爆，导致所有请求一起失败
+
+# 优先级：数字越小越先出队
+PRIORITY_HIGH = 0    # 续聊 (会话里情报已缓存，只需 1~2 次 LLM 调用)
+PRIORITY_NORMAL = 1  # 新行程
+PRIORITY_LOW = 2     # 后台/批量调用方主动降级
+
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+class AdmissionRejected(Exception):
+    """请求被拒绝：429 = 队列已满，503 = 排队超时"""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class AdmissionController:
+    """
+    有界并发 + 有界优先级队列。
+    只在事件循环线程里使用 (FastAPI 的 async 接口)，因此不需要加锁。
+    """
+
+    def __init__(self, max_active: int, max_queue: int, max_wait: float, max_low_queue: int = None):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        # 低优先级 (批量) 最多占多少个排队位置：剩下的留给在线用户，批量再多也挤不满队列
+        self.max_low_queue = max(1, max_queue // 4) if max_low_queue is None else max_low_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters = []             # 堆: [priority, seq, future]
+        self._seq = itertools.count()  # 同优先级先来先服务
+        self._avg_run = 30.0           # 单次规划的平均耗时 (秒)，用于估算 Retry-After
+        self._report()
+
+    # ------------------------------------------
+    # 对外接口
+    # ------------------------------------------
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL):
+        """async with admission.slot(priority): ... 拿不到名额会抛 AdmissionRejected"""
+        started = await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> float:
+        """拿到一个运行名额，返回开始运行的时间戳 (交给 release)"""
+        enqueued = time.monotonic()
+        label = PRIORITY_NAMES.get(priority, str(priority))
+
+        if self._active < self.max_active and not self._waiters:
+            self._active += 1
+            self._admitted(label, 0.0)
+            return time.monotonic()
+
+        if len(self._waiters) >= self.max_queue:
+            metrics.inc("admission_rejected_total", reason="queue_full")
+            raise AdmissionRejected(429, self.retry_after(), "服务繁忙，排队人数已满，请稍后再试")
+        if priority >= PRIORITY_LOW and sum(w[0] >= PRIORITY_LOW for w in self._waiters) >= self.max_low_queue:
+            metrics.inc("admission_rejected_total", reason="low_queue_full")
+            raise AdmissionRejected(429, self.retry_after(), "低优先级排队人数已满，请稍后再试")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), future]
+        heapq.heappush(self._waiters, entry)
+        self._report()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 超时/断开的同一时刻刚好分到名额：要么用掉，要么还回去
+                if isinstance(e, asyncio.TimeoutError):
+                    self._admitted(label, time.monotonic() - enqueued)
+                    return time.monotonic()
+                self._free_slot()
+                raise
+            future.cancel()
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._report()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.inc("admission_rejected_total", reason="queue_timeout")
+                raise AdmissionRejected(503, self.retry_after(), "服务繁忙，排队超时，请稍后再试")
+            raise
+
+        self._admitted(label, time.monotonic() - enqueued)
+        return time.monotonic()
+
+    def release(self, started: float):
+        """运行结束，归还名额并唤醒队首"""
+        elapsed = time.monotonic() - started
+        self._avg_run = 0.9 * self._avg_run + 0.1 * elapsed
+        self._free_slot()
+
+    def _free_slot(self):
+        self._active -= 1
+        while self._waiters and self._active < self.max_active:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._active += 1
+                future.set_result(True)
+        self._report()
+
+    def retry_after(self) -> int:
+        """按平均耗时估算排在最后的人还要等多久 (秒)"""
+        rounds = (len(self._waiters) + 1) / max(1, self.max_active)
+        return max(1, math.ceil(self._avg_run * rounds))
+
+    # ------------------------------------------
+    # 指标
+    # ------------------------------------------
+    def _admitted(self, label: str, waited: float):
+        metrics.inc("admission_admitted_total", priority=label)
+        metrics.observe("admission_wait_seconds", waited, priority=label)
+        self._report()
+
+    def _report(self):
+        metrics.set_gauge("admission_active", self._active)
+        metrics.set_gauge("admission_queue_depth", len(self._waiters))
+
+# 单例：每个 worker 进程一个
+admission = AdmissionController(
+    max_active=int(os.getenv("MAX_ACTIVE_PLANS", "4")),
+    max_queue=int(os.getenv("MAX_QUEUED_PLANS", "16")),
+    max_wait=float(os.getenv("MAX_QUEUE_WAIT_SECONDS", "30")),
+    max_low_queue=int(os.environ["MAX_QUEUED_LOW_PLANS"]) if os.getenv("MAX_QUEUED_LOW_PLANS") else None,
+)
@@ -0,0 +1,212 @@
+# backend/app/api/batch.py
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from app.api.admission import admission, AdmissionRejected, PRIORITY_LOW
+from app.api.encoding import dumps
+from app.tools.cache import SharedCalls, shared_tool_calls
+from app.services.log import get_logger, request_id_var
+from app.services.metrics import metrics
+
+logger = get_logger(__name__)
+
+# 批量规划：合作方一次提交很多 TripRequest (比如 200 个目的地 × 兴趣组合)
+# 1. 整批共享工具调用：同城的天气、酒店、相同的知识库查询只真正执行一次
+# 2. 有界并发：同一批最多 BATCH_CONCURRENCY 个行程同时跑，并且以低优先级走准入控制，不挤占在线用户
+# 3. 结果按完成顺序以 NDJSON 流式返回，或写进结果文件；进度和每一项的状态随时可查
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "2"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "50"))
+BATCH_RESULT_DIR = os.getenv("BATCH_RESULT_DIR", "./batch_results")
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+class BatchItem:
+    def __init__(self, index: int, request):
+        self.index = index
+        self.request = request
+        self.status = STATUS_PENDING
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self, with_result: bool = False) -> dict:
+        data = {"index": self.index, "status": self.status, "city": self.request.city}
+        if self.started_at and self.finished_at:
+            data["duration_seconds"] = round(self.finished_at - self.started_at, 2)
+        if self.error:
+            data["error"] = self.error
+        if with_result:
+            data["request"] = self.request.model_dump()
+            data["result"] = self.result
+        return data
+
+class BatchJob:
+    def __init__(self, requests: list, result_path: str = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.items = [BatchItem(i, r) for i, r in enumerate(requests)]
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result_path = result_path
+        self.shared = SharedCalls()
+        self._completed = []            # 按完成顺序记录的下标
+        self._changed = asyncio.Event()
+        self._file_lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def progress(self, with_items: bool = False) -> dict:
+        counts = {STATUS_PENDING: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0}
+        for item in self.items:
+            counts[item.status] += 1
+        data = {
+            "job_id": self.id,
+            "status": "finished" if self.done else "running",
+            "total": len(self.items),
+            **counts,
+            "created_at": self.created_at,
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 2),
+            # executed: 真正执行的工具调用；shared: 直接复用批内已有结果的调用
+            "tool_calls": {"executed": self.shared.calls, "shared": self.shared.shared},
+            "result_file": self.result_path,
+        }
+        if with_items:
+            data["items"] = [item.to_dict() for item in self.items]
+        return data
+
+    async def results(self):
+        """按完成顺序逐个产出已完成的条目，直到整批结束 (可以多个客户端同时订阅)"""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self._completed):
+                yield self.items[self._completed[sent]]
+                sent += 1
+            if self.done:
+                return
+            await changed.wait()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _write(self, item: BatchItem):
+        with self._file_lock, open(self.result_path, "ab") as f:
+            f.write(dumps(item.to_dict(with_result=True)) + b"\n")
+
+class BatchRunner:
+    """
+    在事件循环里调度批量任务；每个行程在线程池里跑 run_item(TripRequest)，占着准入名额；
+    finish_item(run_item 的返回值) -> dict 是可选的收尾 (如补坐标)，归还名额之后再跑。
+    只在事件循环线程里使用 (和 AdmissionController 一样)，因此不需要加锁。
+    """
+
+    def __init__(self, run_item, concurrency: int = BATCH_CONCURRENCY, max_jobs: int = BATCH_MAX_JOBS,
+                 result_dir: str = BATCH_RESULT_DIR, finish_item=None):
+        self.run_item = run_item
+        self.finish_item = finish_item
+        self.concurrency = concurrency
+        self.max_jobs = max_jobs
+        self.result_dir = result_dir
+        self._jobs = OrderedDict()
+        self._tasks = set()
+
+    def submit(self, requests: list, write_file: bool = False) -> BatchJob:
+        job = BatchJob(requests)
+        if write_file:
+            os.makedirs(self.result_dir, exist_ok=True)
+            job.result_path = os.path.join(self.result_dir, f"{job.id}.ndjson")
+        self._jobs[job.id] = job
+        self._evict()
+
+        # 任务独立于提交它的 HTTP 连接：客户端断开也会跑完，之后可以查进度/结果文件
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info("批量任务已提交", extra={"job_id": job.id, "items": len(job.items)})
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def _evict(self):
+        """只保留最近 max_jobs 个任务的状态 (还在跑的不删)"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+
+    # ------------------------------------------
+    # 调度
+    # ------------------------------------------
+    async def _run(self, job: BatchJob):
+        metrics.inc("batch_jobs_total")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def worker(item):
+            async with semaphore:
+                await self._run_item(job, item)
+
+        try:
+            await asyncio.gather(*(worker(item) for item in job.items))
+        finally:
+            job.finished_at = time.time()
+            job._notify()
+            progress = job.progress()
+            logger.info("批量任务结束", extra={
+                "job_id": job.id, "done": progress[STATUS_DONE], "failed": progress[STATUS_FAILED],
+                "tool_calls": progress["tool_calls"], "elapsed_seconds": progress["elapsed_seconds"],
+            })
+
+    async def _run_item(self, job: BatchJob, item: BatchItem):
+        try:
+            started = await self._admit()
+            item.status = STATUS_RUNNING
+            item.started_at = time.time()
+            try:
+                output = await run_in_threadpool(self._call, job, item, self.run_item, item.request)
+            finally:
+                admission.release(started)
+            if self.finish_item is not None:
+                output = await run_in_threadpool(self._call, job, item, self.finish_item, output)
+            item.result = output
+            item.status = STATUS_DONE
+        except Exception as e:
+            item.status = STATUS_FAILED
+            item.error = str(e)
+            logger.warning("批量条目失败: %s", e, extra={"job_id": job.id, "index": item.index})
+        item.finished_at = time.time()
+        metrics.inc("batch_items_total", status=item.status)
+
+        if job.result_path:
+            await run_in_threadpool(job._write, item)
+        job._completed.append(item.index)
+        job._notify()
+
+    async def _admit(self) -> float:
+        """以低优先级排队拿名额；被拒绝就按 Retry-After 等一会儿再试 (批量任务不怕慢)"""
+        while True:
+            try:
+                return await admission.acquire(PRIORITY_LOW)
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    def _call(self, job: BatchJob, item: BatchItem, fn, arg):
+        # 线程池里运行：日志带上 "批次-下标"，工具调用在整批内共享
+        request_id_var.set(f"{job.id}-{item.index}")
+        with shared_tool_calls(job.shared):
+            return fn(arg)
@@ -0,0 +1,62 @@
+# backend/app/api/encoding.py
+import json
+from typing import List, Optional
+
+from starlette.responses import Response
+
+# 响应序列化：/chat、SSE、批量 NDJSON 共用
+# 1. 装了 orjson 就用它 (比标准库 json 快数倍，直接产出 bytes)；没装自动退回标准库
+# 2. 字段选择：?fields=reply 或 ?fields=session_id,details.critique，只序列化调用方要的部分
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(obj):
+    """Pydantic 模型 (TripPlan / DayPlan ...) 转成 dict，其余不认识的类型转成字符串"""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, default=_default, separators=(",", ":")).encode("utf-8")
+
+# ==========================================
+# 字段选择
+# ==========================================
+def parse_fields(spec: Optional[str]) -> Optional[List[str]]:
+    """"reply,details.critique" -> ["reply", "details.critique"]；没传就是 None (返回全部字段)"""
+    if not spec:
+        return None
+    return [f.strip() for f in spec.split(",") if f.strip()] or None
+
+def wants(fields: Optional[List[str]], key: str) -> bool:
+    """调用方要不要 key 这个顶层字段 (不要的话就不必去算它)"""
+    return fields is None or any(f == key or f.startswith(key + ".") for f in fields)
+
+def select_fields(data: dict, fields: Optional[List[str]]) -> dict:
+    """按点号路径挑出字段，不存在的路径忽略"""
+    if fields is None:
+        return data
+    selected = {}
+    for path in fields:
+        parts = path.split(".")
+        src, dst = data, selected
+        for part in parts[:-1]:
+            if not isinstance(src, dict) or not isinstance(src.get(part), dict):
+                break
+            src = src[part]
+            dst = dst.setdefault(part, {})
+        else:
+            if isinstance(src, dict) and parts[-1] in src:
+                dst[parts[-1]] = src[parts[-1]]
+    return selected
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -1,5 +1,5 @@
 # backend/app/schemas.py
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field, field_validator
 
 # --- 1. 基础组件 ---
@@ -47,6 +47,19 @@ class Budget(BaseModel):
     breakdown: str = Field(..., description="费用明细描述")
 
 # --- 4. 核心行程模型 ---
+class RouteSegment(BaseModel):
+    """路线片段 (PRD2)：实体地点 place 与交通接驳 transport 交替出现"""
+    type: Literal["place", "transport"] = Field(..., description="片段类型")
+    # place 字段
+    name: Optional[str] = Field(None, description="地点名称")
+    description: Optional[str] = Field(None, description="地点描述")
+    emoji: Optional[str] = Field(None, description="地图 Marker 用的 Emoji")
+    coordinates: Optional[List[float]] = Field(None, description="[纬度, 经度]")
+    # transport 字段
+    mode: Optional[str] = Field(None, description="交通方式：walk/transit/taxi")
+    duration: Optional[str] = Field(None, description="耗时，如 15 min")
+    instruction: Optional[str] = Field(None, description="接驳说明")
+
 class DayPlan(BaseModel):
     """单日行程"""
     day_index: int = Field(..., description="第几天")
@@ -56,6 +69,7 @@ class DayPlan(BaseModel):
     attractions: List[Attraction] = Field(default_factory=list, description="游玩景点")
     meals: List[Meal] = Field(default_factory=list, description="餐饮安排")
     hotel: Optional[Hotel] = Field(None, description="住宿安排")
+    route_segments: List[RouteSegment] = Field(default_factory=list, description="路线 (地点与交通交替)")
     daily_summary: str = Field(..., description="当日行程小结")
 
 class TripPlan(BaseModel):
@@ -72,4 +86,5 @@ class TripRequest(BaseModel):
     city: str = Field(..., description="想去哪里")
     days: int = Field(3, description="玩几天")
     interests: Optional[str] = Field(None, description="兴趣偏好 (如: 户外, 历史, 美食)")
-    date_range: Optional[str] = Field(None, description="具体日期")
\ No newline at end of file
+    date_range: Optional[str] = Field(None, description="具体日期")
+    transport_mode: str = Field("transit", description="交通偏好：walk (City Walk) / transit (公共交通) / taxi (打车)")
\ No newline at end of file
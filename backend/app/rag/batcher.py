@@ -0,0 +1,181 @@
+# backend/app/rag/batcher.py
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from app.services.metrics import metrics
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# Embedding 微批处理：
+# 并发用户各自的一条短 query，攒几毫秒 (或攒满一批) 后合并成一次 embed_documents 调用，
+# 再把向量分发回各自的调用方。省掉大量小请求的固定开销和配额。
+# 最多 max_inflight 批同时在飞；都在飞时新文本继续攒，下一批自然更大。
+
+EMBED_MODEL = "models/text-embedding-004"
+
+# 调用方最多等多久 (秒)：批处理出了任何问题都不能让检索永远卡住
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT_SECONDS", "30"))
+
+class EmbeddingBatcher:
+    """
+    线程安全的微批处理器 (后台一个线程负责凑批，发请求交给小线程池)
+    :param max_batch_size: 单次请求最多几条文本
+    :param max_wait_ms: 第一条文本到达后最多再等多久凑批
+    :param max_inflight: 最多几批同时在飞
+    :param task_type: 透传给 Gemini embed_documents 的 task_type (查询用 retrieval_query)
+    """
+
+    def __init__(self, embeddings, max_batch_size: int = 16, max_wait_ms: float = 5, task_type: str = None,
+                 name: str = "query", max_inflight: int = 4, timeout: float = EMBED_TIMEOUT):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.task_type = task_type
+        self.name = name
+        self.timeout = timeout
+        self._queue = []  # [(text, Future)]
+        self._cond = threading.Condition()
+        self._worker = None
+        self._inflight = threading.BoundedSemaphore(max_inflight)
+        self._pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix=f"embed-{name}")
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        with self._cond:
+            # 凑批线程意外退出了就重新拉起来 (否则之后的请求永远没人处理)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"embed-batcher-{self.name}", daemon=True)
+                self._worker.start()
+            self._queue.append((text, future))
+            self._cond.notify()
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result(timeout=self.timeout)
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """一次提交多条 (入库场景)，后台按 max_batch_size 切批"""
+        futures = [self.submit(t) for t in texts]
+        # 入库一次可能有很多批，按批数放宽超时
+        timeout = self.timeout * max(1, -(-len(texts) // self.max_batch_size))
+        deadline = time.monotonic() + timeout
+        return [f.result(timeout=max(0.0, deadline - time.monotonic())) for f in futures]
+
+    def _run(self):
+        # 这里意外退出的话，下一次 submit() 会重新拉起线程
+        while True:
+            batch = self._next_batch()
+            try:
+                self._pool.submit(self._flush, batch)
+            except Exception as e:
+                # 交给线程池失败：这一批直接失败，继续处理后面的
+                logger.exception("Embedding 批处理调度失败: %s", e)
+                self._fail(batch, e)
+                self._inflight.release()
+
+    def _next_batch(self):
+        # 在飞的批次满了就先等一等，期间到达的文本继续攒进下一批
+        self._inflight.acquire()
+        try:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # 第一条到了：最多再等 max_wait，或者凑满一批就立刻发
+                deadline = time.monotonic() + self.max_wait
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.max_batch_size]
+                del self._queue[:self.max_batch_size]
+                return batch
+        except BaseException:
+            self._inflight.release()
+            raise
+
+    def _flush(self, batch):
+        """在线程池里发一批；任何异常 (包括返回的向量数量不对) 都转成这一批调用方的异常"""
+        try:
+            self._embed_batch(batch)
+        except Exception as e:
+            metrics.inc("embedding_batch_errors_total", batcher=self.name)
+            logger.warning("Embedding 批请求失败 (%s 条): %s", len(batch), e)
+            self._fail(batch, e)
+        finally:
+            self._inflight.release()
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _embed_batch(self, batch):
+        # 同一批里重复的文本只算一次
+        unique = list(dict.fromkeys(text for text, _ in batch))
+        started = time.monotonic()
+        if self.task_type:
+            vectors = self.embeddings.embed_documents(unique, task_type=self.task_type)
+        else:
+            vectors = self.embeddings.embed_documents(unique)
+        if len(vectors) != len(unique):
+            raise RuntimeError(f"Embedding 返回了 {len(vectors)} 个向量，期望 {len(unique)} 个")
+
+        by_text = dict(zip(unique, vectors))
+        for text, future in batch:
+            future.set_result(by_text[text])
+
+        metrics.inc("embedding_batches_total", batcher=self.name)
+        metrics.inc("embedding_texts_total", len(batch), batcher=self.name)
+        metrics.observe("embedding_batch_size", len(batch), batcher=self.name)
+        metrics.observe("embedding_batch_fill_ratio", len(batch) / self.max_batch_size, batcher=self.name)
+        metrics.observe("embedding_batch_seconds", time.monotonic() - started, batcher=self.name)
+
+class BatchedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings 适配器：可以直接交给 Milvus 当 embedding_function。
+    检索 (embed_query) 和入库 (embed_documents) 各走一个批处理器。
+    """
+
+    def __init__(self, query_batcher: EmbeddingBatcher, document_batcher: EmbeddingBatcher):
+        self.query_batcher = query_batcher
+        self.document_batcher = document_batcher
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.query_batcher.embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.document_batcher.embed_many(texts)
+
+# 单例：整个进程共用一组批处理器，否则就攒不到别人的请求了
+_batched_embeddings = None
+_lock = threading.Lock()
+
+def get_batched_embeddings() -> BatchedEmbeddings:
+    global _batched_embeddings
+    with _lock:
+        if _batched_embeddings is None:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+            api_key = os.getenv("LLM_API_KEY")
+            if not api_key:
+                raise ValueError("LLM_API_KEY not found in environment variables")
+
+            embeddings = GoogleGenerativeAIEmbeddings(model=EMBED_MODEL, google_api_key=api_key)
+            batch_size = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+            wait_ms = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+            inflight = int(os.getenv("EMBED_MAX_INFLIGHT", "4"))
+            _batched_embeddings = BatchedEmbeddings(
+                query_batcher=EmbeddingBatcher(embeddings, batch_size, wait_ms, task_type="retrieval_query",
+                                               name="query", max_inflight=inflight),
+                document_batcher=EmbeddingBatcher(embeddings, batch_size, wait_ms, task_type="retrieval_document",
+                                                  name="document", max_inflight=inflight),
+            )
+        return _batched_embeddings
@@ -1,64 +1,130 @@
 # backend/app/rag/retriever.py
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+import time
+from typing import Optional
 from langchain_milvus import Milvus
 from dotenv import load_dotenv, find_dotenv
+from app.rag.batcher import get_batched_embeddings
+from app.tools.result import ToolResult
+from app.tools.cache import batch_shared
+from app.services.tracing import span
+from app.services.log import get_logger
+from app.services.geocoding import normalize_city
+from app.services.metrics import metrics
+
+logger = get_logger(__name__)
 
 # 加载环境
 load_dotenv(find_dotenv(usecwd=True))
 
+# 多目的地知识库：一个 Collection，用 city 字段做 Milvus 分区键 (Partition Key)
+# 写入时 Milvus 按 city 自动路由到对应分区；检索时带上 city 过滤，只扫这个城市所在的分区
+# 城市再多，单次检索扫描的数据量也基本不变
+RAG_DB_URI = os.getenv("RAG_DB_URI", "./travel_data.db")
+RAG_COLLECTION = os.getenv("RAG_COLLECTION", "travel_guides")
+PARTITION_KEY = "city"
+NUM_PARTITIONS = int(os.getenv("RAG_NUM_PARTITIONS", "64"))
+# "这个城市有没有数据" 的结果缓存多久 (新导入的城市最迟这么久后可见)
+CITY_CHECK_TTL = int(os.getenv("RAG_CITY_CHECK_TTL", "300"))
+
+def city_key(city: str) -> str:
+    """分区键统一成小写、只取第一段："Hamilton, Ontario" -> "hamilton" (也去掉了引号，可以安全拼进过滤表达式)"""
+    return normalize_city(city)
+
+def milvus_kwargs() -> dict:
+    """建库 (ingest) 和检索共用的 Milvus 参数"""
+    return {
+        "connection_args": {"uri": RAG_DB_URI},
+        "collection_name": RAG_COLLECTION,
+        "partition_key_field": PARTITION_KEY,
+        "num_partitions": NUM_PARTITIONS,
+        # 其余元数据 (category / tags) 走动态字段，不用为每个新字段改表结构
+        "enable_dynamic_field": True,
+    }
+
+_vector_store = None
+_vector_store_lock = threading.Lock()
+
+_known_cities = {}  # city_key -> (过期时间, 是否有数据)
+_known_cities_lock = threading.Lock()
+
 def get_retriever():
-    """获取 Milvus 检索器实例"""
-    api_key = os.getenv("LLM_API_KEY")
-    if not api_key:
-        raise ValueError("LLM_API_KEY not found in environment variables")
+    """获取 Milvus 检索器实例 (进程内复用同一个连接)"""
+    global _vector_store
+    with _vector_store_lock:
+        if _vector_store is None:
+            # 查询向量走微批处理：并发请求的 query 会被合并成一次 Embedding 调用
+            embeddings = get_batched_embeddings()
 
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/text-embedding-004",
-        google_api_key=api_key
-    )
+            # 连接已有的数据库
+            _vector_store = Milvus(
+                embedding_function=embeddings,
+                auto_id=True,
+                **milvus_kwargs()
+            )
+        return _vector_store
 
-    # 连接已有的数据库
-    vector_store = Milvus(
-        embedding_function=embeddings,
-        connection_args={"uri": "./travel_data.db"},
-        collection_name="hamilton_travel_guides",
-        auto_id=True
-    )
-    
-    return vector_store
+def has_city(vector_store, key: str) -> bool:
+    """这个城市的分区里有没有数据 (只做一次标量过滤查询，结果缓存 CITY_CHECK_TTL 秒)"""
+    now = time.time()
+    with _known_cities_lock:
+        cached = _known_cities.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+    # 只要一条：get_pks 会把整个分区的主键都拉回来，城市数据越多越慢
+    # col 为 None 说明 Collection 还没建 (没导入过任何数据)
+    found = vector_store.col is not None and bool(vector_store.col.query(
+        f'{PARTITION_KEY} == "{key}"', output_fields=[vector_store._primary_field], limit=1
+    ))
+    with _known_cities_lock:
+        _known_cities[key] = (now + CITY_CHECK_TTL, found)
+    return found
 
-def search_knowledge_base(query: str, k: int = 2) -> str:
+@batch_shared
+def search_knowledge_base(query: str, k: int = 2, city: Optional[str] = None) -> ToolResult:
     """
     RAG 核心检索函数
     Args:
-        query: 用户的查询 (例如 "Hamilton 哪里看夜景？")
+        query: 用户的查询 (例如 "哪里看夜景？")
         k: 返回几条最相似的结果
+        city: 目的地城市 (例如 "Hamilton")。给了就只在这个城市的分区里检索
     Returns:
-        拼接好的文本内容
+        ToolResult: 成功时 data 为拼接好的文本 (没查到则为空)，出错时为失败结果
     """
     try:
         vector_store = get_retriever()
-        # 相似度搜索
-        results = vector_store.similarity_search(query, k=k)
+        expr = None
+        if city:
+            key = city_key(city)
+            # 知识库里没有这个城市：直接返回空结果，省掉一次 Embedding 调用和向量检索
+            if not key or not has_city(vector_store, key):
+                metrics.inc("rag_city_misses_total")
+                return ToolResult.success("")
+            expr = f'{PARTITION_KEY} == "{key}"'
+
+        # 相似度搜索 (带 city 过滤时只扫对应分区)
+        with span("milvus.search", "rag", k=k, city=city) as s:
+            results = vector_store.similarity_search(query, k=k, expr=expr)
+            s.set("hits", len(results))
         
         if not results:
-            return ""
+            return ToolResult.success("")
             
         # 格式化输出
         formatted_results = []
         for i, doc in enumerate(results):
             formatted_results.append(f"【独家情报 {i+1}】: {doc.page_content}")
             
-        return "\n".join(formatted_results)
+        return ToolResult.success("\n".join(formatted_results))
         
     except Exception as e:
-        print(f"⚠️ RAG 检索失败: {e}")
-        return ""
+        logger.warning("RAG 检索失败: %s", e)
+        return ToolResult.failure(f"RAG 检索失败: {e}")
 
 # 测试代码
 if __name__ == "__main__":
     # 测试一下能不能查到
     print("🔍 测试 RAG 检索...")
-    result = search_knowledge_base("推荐个好喝的咖啡店")
+    result = search_knowledge_base("推荐个好喝的咖啡店", city="Hamilton")
     print(result)
\ No newline at end of file
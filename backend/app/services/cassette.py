@@ -0,0 +1,214 @@
+# backend/app/services/cassette.py
+import atexit
+import functools
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from app.tools.result import ToolResult
+from app.services.log import get_logger
+from app.services.metrics import metrics
+
+logger = get_logger(__name__)
+
+# 录制/回放 (Cassette)：把 LLM 和工具的每一次 "请求 -> 响应" 连同当时的耗时存进磁带文件
+# 回放时完全离线 (不需要 API Key / 网络)，用来做可重复的性能回归：
+# 上游每次返回都不一样，只有固定住它们，才分得清耗时变化是不是我们自己的代码造成的
+#
+# 挂载点 (两处就覆盖了所有外部调用)：
+#   LLM:  LLMGateway._call (所有节点、路由、快速通道都走网关)
+#   工具: cached_tool / batch_shared 装饰器里真正调用上游的那一层 (缓存、批内共享都在它上面，回放时照常工作)
+#
+# 环境变量：
+#   CASSETTE_MODE     off (默认) / record / replay
+#   CASSETTE_PATH     磁带文件 (gzip 压缩的 JSONL)，默认 ./cassette.jsonl.gz
+#   CASSETTE_LATENCY  回放耗时倍数：0 = 立即返回 (默认)，1 = 按录制时的耗时等待，0.5 = 一半 ...
+#   CASSETTE_STRICT   true 时请求必须和录制时完全一致；默认允许按顺序兜底
+#                     (Prompt 里带了当天日期之类会变的内容时，按同类调用的录制顺序回放)
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+KIND_LLM = "llm"
+KIND_TOOL = "tool"
+
+class CassetteMiss(Exception):
+    """回放时磁带里找不到对应的录制 (说明这次请求的调用和录制时不一样)"""
+
+# ==========================================
+# 1. 请求指纹 / 响应序列化
+# ==========================================
+def _plain(obj):
+    """LangChain 消息等对象 -> 可稳定序列化的普通结构 (只保留影响结果的字段)"""
+    if isinstance(obj, (list, tuple)):
+        return [_plain(o) for o in obj]
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if hasattr(obj, "type") and hasattr(obj, "content"):
+        data = {"type": obj.type, "content": _plain(obj.content)}
+        if getattr(obj, "tool_calls", None):
+            data["tool_calls"] = [{"name": c.get("name"), "args": c.get("args")} for c in obj.tool_calls]
+        if getattr(obj, "tool_call_id", None):
+            data["tool_call_id"] = obj.tool_call_id
+        return data
+    return obj
+
+def fingerprint(*parts) -> str:
+    text = json.dumps(_plain(list(parts)), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+def _dump_llm(message):
+    from langchain_core.messages import message_to_dict
+    return message_to_dict(message)
+
+def _load_llm(data):
+    from langchain_core.messages import messages_from_dict
+    return messages_from_dict([data])[0]
+
+def _dump_tool(result):
+    return result.to_json() if isinstance(result, ToolResult) else json.dumps({"raw": str(result)}, ensure_ascii=False)
+
+def _load_tool(data):
+    payload = json.loads(data)
+    return payload["raw"] if "raw" in payload else ToolResult.from_json(data)
+
+# ==========================================
+# 2. 磁带
+# ==========================================
+class Cassette:
+    def __init__(self, mode: str = MODE_OFF, path: str = "./cassette.jsonl.gz", latency_scale: float = 0.0,
+                 strict: bool = False):
+        self.mode = mode if mode in (MODE_RECORD, MODE_REPLAY) else MODE_OFF
+        self.path = path
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._recorded = []
+        self._saved = 0
+        self._by_key = defaultdict(deque)   # (kind, name, key) -> 录制条目
+        self._by_name = defaultdict(deque)  # (kind, name) -> 录制条目 (按录制顺序，用于兜底)
+        if self.mode == MODE_REPLAY:
+            self.load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != MODE_OFF
+
+    # ------------------------------------------
+    # 对外接口：包一层真实调用
+    # ------------------------------------------
+    def call(self, kind: str, name: str, key: str, live):
+        """record: 调真实接口并录下来；replay: 从磁带取；off: 直接调"""
+        if self.mode == MODE_REPLAY:
+            return self._replay(kind, name, key)
+        if self.mode == MODE_OFF:
+            return live()
+
+        started = time.perf_counter()
+        result = live()
+        latency = time.perf_counter() - started
+        dump = _dump_llm if kind == KIND_LLM else _dump_tool
+        with self._lock:
+            self._recorded.append({"kind": kind, "name": name, "key": key, "latency": round(latency, 4),
+                                   "response": dump(result)})
+        return result
+
+    def llm_call(self, tier: str, input, tools, live):
+        name = f"{tier}+tools" if tools else tier
+        return self.call(KIND_LLM, name, fingerprint(tier, tools, input), live)
+
+    def wrap_tool(self, name: str, func):
+        """给 MCP 注册表里的工具函数套一层 (保留原函数签名和 docstring，StructuredTool 靠它们生成 schema)"""
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = fingerprint(name, args, kwargs)
+            return self.call(KIND_TOOL, name, key, lambda: func(*args, **kwargs))
+        return wrapper
+
+    # ------------------------------------------
+    # 回放
+    # ------------------------------------------
+    def _replay(self, kind: str, name: str, key: str):
+        with self._lock:
+            entry = self._take(self._by_key[(kind, name, key)])
+            matched = "exact"
+            if entry is None and not self.strict:
+                entry = self._take(self._by_name[(kind, name)])
+                matched = "sequence"
+        if entry is None:
+            metrics.inc("cassette_misses_total", kind=kind)
+            raise CassetteMiss(f"磁带里没有可回放的 {kind} 调用: {name} ({key})")
+
+        metrics.inc("cassette_replays_total", kind=kind, match=matched)
+        if self.latency_scale > 0:
+            time.sleep(entry["latency"] * self.latency_scale)
+        load = _load_llm if kind == KIND_LLM else _load_tool
+        return load(entry["response"])
+
+    @staticmethod
+    def _take(entries: deque):
+        """取出第一条还没用过的录制 (同一条录制可能同时挂在两个索引里)"""
+        while entries:
+            entry = entries.popleft()
+            if not entry.get("_used"):
+                entry["_used"] = True
+                return entry
+        return None
+
+    # ------------------------------------------
+    # 读写文件
+    # ------------------------------------------
+    def load(self):
+        if not os.path.exists(self.path):
+            logger.warning("磁带文件不存在: %s", self.path)
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            count = 0
+            for line in f:
+                entry = json.loads(line)
+                self._by_key[(entry["kind"], entry["name"], entry["key"])].append(entry)
+                self._by_name[(entry["kind"], entry["name"])].append(entry)
+                count += 1
+        logger.info("已加载磁带 %s (%s 条录制)", self.path, count, extra={"recorded_at": header.get("created_at")})
+
+    def save(self):
+        """写出本次录制的全部条目 (录制模式下进程退出时自动调用)"""
+        if self.mode != MODE_RECORD:
+            return
+        with self._lock:
+            entries = list(self._recorded)
+        if entries and len(entries) == self._saved:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"version": 1, "created_at": time.time()}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._saved = len(entries)
+        logger.info("磁带已保存: %s (%s 条录制)", self.path, len(entries))
+
+def _create_cassette() -> Cassette:
+    cassette = Cassette(
+        mode=os.getenv("CASSETTE_MODE", MODE_OFF).lower(),
+        path=os.getenv("CASSETTE_PATH", "./cassette.jsonl.gz"),
+        latency_scale=float(os.getenv("CASSETTE_LATENCY", "0")),
+        strict=os.getenv("CASSETTE_STRICT", "false").lower() == "true",
+    )
+    if cassette.mode == MODE_RECORD:
+        atexit.register(cassette.save)
+    if cassette.enabled:
+        logger.info("录制/回放已开启: %s (%s)", cassette.mode, cassette.path)
+    return cassette
+
+cassette = _create_cassette()
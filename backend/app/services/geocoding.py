@@ -0,0 +1,285 @@
+# backend/app/services/geocoding.py
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from app.models.schemas import DayPlan, Location, TripPlan
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 坐标服务 (PRD2 3.2)：地点名 -> 本地缓存 (SQLite) -> Nominatim (OpenStreetMap)
+
+# ==========================================
+# 1. 名称归一化 (缓存 Key)
+# ==========================================
+def normalize_name(name: str) -> str:
+    """统一大小写/全半角/标点，让 "Dundurn Castle" 和 "dundurn  castle!" 命中同一条缓存"""
+    text = unicodedata.normalize("NFKC", name or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def normalize_city(city: str) -> str:
+    """"Hamilton, Ontario, Canada" -> "hamilton" (只取第一段)"""
+    return normalize_name((city or "").split(",")[0])
+
+def cache_key(name: str, city: str) -> str:
+    return f"{normalize_name(name)}|{normalize_city(city)}"
+
+# ==========================================
+# 2. 限流器 (Nominatim 要求每秒最多 1 次)
+# ==========================================
+class RateLimiter:
+    """线程安全的匀速限流：每次调用前 wait()，保证两次请求间隔不小于 1/rate 秒"""
+
+    def __init__(self, rate_per_second: float):
+        self._interval = 1.0 / rate_per_second if rate_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# ==========================================
+# 3. 坐标提供方 (可插拔)
+# ==========================================
+class GeocodingProvider:
+    """
+    坐标提供方接口。
+    geocode() 找不到返回 None (会被缓存)；网络等临时错误直接抛异常 (不缓存)。
+    """
+    name = "base"
+    max_concurrency = 1            # 同时在飞的请求数
+    rate_per_second: Optional[float] = None  # None 表示不限流
+
+    def geocode(self, name: str, city: str) -> Optional[Location]:
+        raise NotImplementedError
+
+class NominatimProvider(GeocodingProvider):
+    """OpenStreetMap Nominatim (免费，但必须带 User-Agent 且遵守限流)"""
+    name = "nominatim"
+
+    def __init__(self):
+        self.url = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+        self.user_agent = os.getenv("NOMINATIM_USER_AGENT", "travel-agent-ai/1.0")
+        self.rate_per_second = float(os.getenv("NOMINATIM_RATE", "1"))
+        self.max_concurrency = int(os.getenv("NOMINATIM_CONCURRENCY", "2"))
+
+    def geocode(self, name: str, city: str) -> Optional[Location]:
+        response = requests.get(
+            self.url,
+            params={"q": f"{name}, {city}", "format": "jsonv2", "limit": 1},
+            headers={"User-Agent": self.user_agent},
+            timeout=5
+        )
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return Location(latitude=float(results[0]["lat"]), longitude=float(results[0]["lon"]))
+
+class StaticProvider(GeocodingProvider):
+    """本地替身：从字典里查坐标，不发网络请求 (测试/压测用)"""
+    name = "static"
+
+    def __init__(self, places: Dict[str, Tuple[float, float]], latency: float = 0.0, max_concurrency: int = 8):
+        # places 的 key 可以是 "地点名" 或 "地点名|城市"
+        self._places = {}
+        for key, (lat, lon) in places.items():
+            name, _, city = key.partition("|")
+            norm = cache_key(name, city) if city else normalize_name(name)
+            self._places[norm] = Location(latitude=lat, longitude=lon)
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+
+    def geocode(self, name: str, city: str) -> Optional[Location]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._places.get(cache_key(name, city)) or self._places.get(normalize_name(name))
+
+# ==========================================
+# 4. 持久化缓存 (SQLite，按 归一化名称|城市 建主键索引)
+# ==========================================
+class GeocodeCache:
+    def __init__(self, path: str = None, negative_ttl: float = 7 * 24 * 3600):
+        self.path = path or os.getenv("GEOCODE_DB_PATH", "./geocode.db")
+        self.negative_ttl = negative_ttl  # "查无此地" 多久后重新查一次
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, latitude REAL, longitude REAL,"
+                " found INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[Location]]:
+        """批量查缓存：只返回命中的 key (值为 None 表示已确认查不到)"""
+        hits = {}
+        now = time.time()
+        # SQLite 单条语句的参数个数有上限，分批查
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, latitude, longitude, found, updated_at FROM geocode WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+            for key, lat, lon, found, updated_at in rows:
+                if found:
+                    hits[key] = Location(latitude=lat, longitude=lon)
+                elif now - updated_at < self.negative_ttl:
+                    hits[key] = None
+        return hits
+
+    def put_many(self, results: Dict[str, Optional[Location]]):
+        now = time.time()
+        rows = [
+            (key, loc.latitude if loc else None, loc.longitude if loc else None, 1 if loc else 0, now)
+            for key, loc in results.items()
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+# ==========================================
+# 5. 批量解析
+# ==========================================
+class Geocoder:
+    """
+    一次性解析一整份行程里的地点：
+    去重 -> 批量查 SQLite 缓存 -> 未命中的按提供方的并发/限流并行查询 -> 回写缓存
+    同一个地点同时只查一次：流式接口提前发起的预取和最后的完整解析共用一个在飞请求
+    """
+
+    def __init__(self, provider: GeocodingProvider = None, cache: GeocodeCache = None):
+        self.provider = provider or NominatimProvider()
+        self.cache = cache or GeocodeCache()
+        self._limiter = RateLimiter(self.provider.rate_per_second)
+        self._pool = ThreadPoolExecutor(max_workers=self.provider.max_concurrency, thread_name_prefix="geocode")
+        # 预取单独一个池：它会等 _pool 里的查询，放在同一个池里可能互相等死
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="geocode-prefetch")
+        self._inflight = {}  # cache_key -> Future
+        self._inflight_lock = threading.Lock()
+
+    def resolve_many(self, places: Iterable[Tuple[str, str]], fetch: bool = True,
+                     timeout: Optional[float] = None) -> Dict[str, Optional[Location]]:
+        """
+        places: [(地点名, 城市), ...]，返回 {cache_key: Location 或 None}
+        fetch=False 时只查缓存、不等网络：未命中的交给后台预取，这次的结果里没有它们
+        timeout: 最多等网络这么多秒，没查完的留在后台继续查 (查好写进缓存)，这次的结果里没有它们
+        """
+        unique = {}
+        for name, city in places:
+            if name:
+                unique.setdefault(cache_key(name, city), (name, city))
+        if not unique:
+            return {}
+
+        resolved = self.cache.get_many(list(unique))
+        misses = {key: unique[key] for key in unique if key not in resolved}
+        if misses and not fetch:
+            self.prefetch(misses.values())
+        elif misses:
+            futures = self._fetch(misses)
+            done, _ = wait(futures.values(), timeout=timeout)
+            for key, future in futures.items():
+                if future not in done:
+                    continue
+                loc = future.result()
+                # 临时错误 (_FAILED) 不缓存，下次再试
+                if loc is not _FAILED:
+                    resolved[key] = loc
+        return resolved
+
+    def prefetch(self, places: Iterable[Tuple[str, str]]):
+        """后台查好坐标写进缓存 (不阻塞调用方)"""
+        places = list(places)
+        if places:
+            self._prefetch_pool.submit(self.resolve_many, places)
+
+    def _fetch(self, misses: Dict[str, Tuple[str, str]]):
+        futures = {}
+        with self._inflight_lock:
+            for key, (name, city) in misses.items():
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._pool.submit(self._lookup, key, name, city)
+                    self._inflight[key] = future
+                futures[key] = future
+        return futures
+
+    def _lookup(self, key: str, name: str, city: str):
+        try:
+            self._limiter.wait()
+            try:
+                loc = self.provider.geocode(name, city)
+            except Exception as e:
+                logger.warning("%s 查询失败 (%s): %s", self.provider.name, name, e)
+                return _FAILED
+            self.cache.put_many({key: loc})
+            return loc
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def geocode_days(self, days: List[DayPlan], city: str = None, fetch: bool = True,
+                     timeout: Optional[float] = None) -> List[DayPlan]:
+        """
+        给若干天的景点和 place 片段填上坐标 (原地修改)；city 是 DayPlan 没写城市时的兜底
+        fetch=False: 只用缓存里已有的坐标，其余后台预取 (流式推送时不让 Nominatim 的限流拖住事件)
+        timeout: 最多等网络这么多秒 (见 resolve_many)
+        """
+        places = []
+        for day in days:
+            day_city = day.city or city
+            places += [(a.name, day_city) for a in day.attractions if a.location is None]
+            places += [(s.name, day_city) for s in day.route_segments if s.type == "place" and not s.coordinates]
+
+        resolved = self.resolve_many(places, fetch=fetch, timeout=timeout)
+        for day in days:
+            day_city = day.city or city
+            for attraction in day.attractions:
+                loc = resolved.get(cache_key(attraction.name, day_city))
+                if loc and attraction.location is None:
+                    attraction.location = loc
+            for segment in day.route_segments:
+                loc = resolved.get(cache_key(segment.name or "", day_city))
+                if loc and segment.type == "place" and not segment.coordinates:
+                    segment.coordinates = [loc.latitude, loc.longitude]
+        return days
+
+    def geocode_trip_plan(self, plan: TripPlan) -> TripPlan:
+        self.geocode_days(plan.days, plan.city)
+        return plan
+
+# 临时错误的占位符 (区别于 "查不到" 的 None)
+_FAILED = object()
+
+# 单例：整个应用共用一个坐标服务 (第一次用到时才建 SQLite 连接)
+_geocoder: Optional[Geocoder] = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder() -> Geocoder:
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = Geocoder()
+        return _geocoder
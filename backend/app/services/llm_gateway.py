@@ -0,0 +1,334 @@
+# backend/app/services/llm_gateway.py
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.services.metrics import metrics
+from app.services.tracing import is_tracing, payload_size, span
+from app.services.cassette import cassette
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
+
+# LLM 网关：所有节点的 LLM 调用都走这里
+# 1. 多 Key / 多模型组成端点池，按负载分配请求
+# 2. 对冲请求 (Hedging)：主请求超过 p95 还没回来，就向另一个端点 (不同的模型/Key) 再发一份，谁先回来用谁；
+#    输掉的一份在下一个流式分片处中止。延迟样本不够 (冷启动) 或只有一个端点时不对冲
+# 3. 配额错误 (429 / ResourceExhausted) 的端点暂时熔断，请求自动切到其它端点；
+#    超时、服务端 5xx 也切换，其余错误 (400 参数错误、安全拦截...) 换端点也一样，直接抛出
+# 4. 分层：extractor / critic 这类简单任务走 fast 档 (更快的模型)，planner 走 default 档
+
+TIER_DEFAULT = "default"
+TIER_FAST = "fast"
+
+def _is_quota_error(e: Exception) -> bool:
+    text = f"{type(e).__name__} {e}".lower()
+    return any(s in text for s in ("429", "resourceexhausted", "resource_exhausted", "quota", "rate limit"))
+
+# 超时 / 服务端错误 (google.api_core 的异常类名，或 "503 ..." 这样以状态码开头的消息)
+_TRANSIENT_NAMES = ("timeout", "deadlineexceeded", "serviceunavailable", "internalservererror", "badgateway")
+_TRANSIENT_TEXT = ("timed out", "deadline exceeded", "unavailable", "internal error")
+
+def _is_retryable(e: Exception) -> bool:
+    """换一个端点可能就成功的错误：配额、超时、5xx"""
+    if _is_quota_error(e) or isinstance(e, TimeoutError):
+        return True
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    if isinstance(code, int) and 500 <= code < 600:
+        return True
+    name, text = type(e).__name__.lower(), str(e).lower()
+    return (any(s in name for s in _TRANSIENT_NAMES) or any(s in text for s in _TRANSIENT_TEXT)
+            or re.match(r"\s*5\d\d\b", text) is not None)
+
+class _Cancelled(Exception):
+    """对冲中输掉的请求被中止"""
+
+class _KeyState:
+    """同一个 (模型, Key) 的配额状态，被多个档位的端点共享"""
+
+    def __init__(self):
+        self.cooldown_until = 0.0
+        self.quota_failures = 0
+        self.lock = threading.Lock()
+
+    def cooling(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def trip(self):
+        """配额耗尽：熔断 5s、10s、20s ... 最长 2 分钟"""
+        with self.lock:
+            self.quota_failures += 1
+            self.cooldown_until = time.monotonic() + min(120.0, 5.0 * 2 ** (self.quota_failures - 1))
+
+    def reset(self):
+        with self.lock:
+            self.quota_failures = 0
+
+class LLMEndpoint:
+    """端点 = 模型 + API Key；客户端第一次用到时才创建"""
+
+    def __init__(self, model: str, api_key: str, tier: str, key_state: _KeyState, rank: int = 0):
+        self.model = model
+        self.api_key = api_key
+        self.tier = tier
+        self.rank = rank  # 0 = 该档主模型，越大越靠后 (备用模型)
+        self.key_state = key_state
+        self.label = f"{model}#{(api_key or '')[-4:]}"
+        self.inflight = 0
+        self.latencies = deque(maxlen=200)
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                self._client = ChatGoogleGenerativeAI(model=self.model, temperature=0, google_api_key=self.api_key)
+            return self._client
+
+    def p95(self):
+        """最近样本的 p95 延迟；样本太少返回 None"""
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def run(self, call, cancelled: threading.Event):
+        """
+        在工作线程里执行一次调用，顺便记录延迟和配额状态
+        call(client) 返回流式分片的迭代器：每个分片之间检查 cancelled，被取消就关掉流 (停止生成、不再计费)
+        """
+        with self._lock:
+            self.inflight += 1
+        started = time.monotonic()
+        try:
+            result = _collect(call(self.client), cancelled)
+        except _Cancelled:
+            metrics.inc("llm_calls_total", endpoint=self.label, outcome="cancelled")
+            raise
+        except Exception as e:
+            if _is_quota_error(e):
+                self.key_state.trip()
+                metrics.inc("llm_quota_errors_total", endpoint=self.label)
+            metrics.inc("llm_calls_total", endpoint=self.label, outcome="error")
+            raise
+        finally:
+            with self._lock:
+                self.inflight -= 1
+        elapsed = time.monotonic() - started
+        self.latencies.append(elapsed)
+        self.key_state.reset()
+        metrics.inc("llm_calls_total", endpoint=self.label, outcome="ok")
+        metrics.observe("llm_endpoint_latency_seconds", elapsed, endpoint=self.label)
+        return result
+
+def _collect(chunks, cancelled: threading.Event):
+    """把流式分片拼成完整消息 (AIMessageChunk 相加会合并内容和工具调用)"""
+    from langchain_core.messages import message_chunk_to_message
+
+    result = None
+    try:
+        for chunk in chunks:
+            if cancelled.is_set():
+                raise _Cancelled()
+            result = chunk if result is None else result + chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    if result is None:
+        raise RuntimeError("LLM 返回了空响应")
+    return message_chunk_to_message(result)
+
+class LLMGateway:
+    def __init__(self, endpoints, hedge_enabled=True, hedge_min=1.0, hedge_max=30.0, max_workers=32):
+        self.endpoints = endpoints
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    # ------------------------------------------
+    # 对外接口 (与 ChatModel.invoke 用法一致)
+    # ------------------------------------------
+    def invoke(self, input, tier: str = TIER_DEFAULT, **kwargs):
+        return self._call(tier, lambda client: client.stream(input, **kwargs), input)
+
+    def bind_tools(self, tools, tier: str = TIER_DEFAULT):
+        """返回一个绑定了工具的网关视图 (给 ReAct 式的 Agent 用)"""
+        return _BoundGateway(self, tools, tier)
+
+    # ------------------------------------------
+    # 调度
+    # ------------------------------------------
+    def _candidates(self, tier: str):
+        """可用端点优先主模型、再按在飞请求数排序 (同负载随机打散)；熔断中的排最后兜底"""
+        pool = [e for e in self.endpoints if e.tier == tier] or [e for e in self.endpoints if e.tier == TIER_DEFAULT]
+        random.shuffle(pool)
+        return sorted(pool, key=lambda e: (e.key_state.cooling(), e.rank, e.inflight))
+
+    def _hedge_delay(self, endpoint: LLMEndpoint):
+        """对冲等待时间 = 该端点 (档位) 的 p95；样本不够就返回 None，不对冲 (固定默认值会把慢任务几乎全部翻倍)"""
+        p95 = endpoint.p95()
+        if p95 is None:
+            return None
+        return min(self.hedge_max, max(self.hedge_min, p95))
+
+    @staticmethod
+    def _hedge_target(primary: LLMEndpoint, queue: list):
+        """对冲只发往另一个 (模型, Key)：同一个 Key 再发一份只会多花一倍配额"""
+        for i, endpoint in enumerate(queue):
+            if endpoint.key_state is not primary.key_state and not endpoint.key_state.cooling():
+                return queue.pop(i)
+        return None
+
+    def _submit(self, endpoint, call, with_context: bool):
+        cancelled = threading.Event()
+        if with_context:
+            # 主请求带上当前上下文 (LangGraph 的流式回调靠它拿到 token)
+            ctx = contextvars.copy_context()
+            return self._pool.submit(ctx.run, endpoint.run, call, cancelled), cancelled
+        # 对冲请求不带回调上下文，避免两份 token 同时流向前端
+        return self._pool.submit(endpoint.run, call, cancelled), cancelled
+
+    @staticmethod
+    def _add(pending: dict, submitted, endpoint):
+        future, cancelled = submitted
+        pending[future] = (endpoint, cancelled)
+
+    def _call(self, tier: str, call, input=None, tools=None):
+        with span("llm", "llm", tier=tier) as s:
+            if is_tracing():
+                s.set("input_bytes", payload_size(input))
+            if cassette.enabled:
+                # 录制/回放：回放时直接从磁带取，不需要任何端点
+                s.set("cassette", cassette.mode)
+                result = cassette.llm_call(tier, input, tools, lambda: self._dispatch(tier, call, s))
+            else:
+                result = self._dispatch(tier, call, s)
+            if is_tracing():
+                s.set("output_bytes", payload_size(getattr(result, "content", result)))
+            return result
+
+    def _dispatch(self, tier: str, call, s):
+        candidates = self._candidates(tier)
+        if not candidates:
+            raise RuntimeError("LLM 网关没有可用端点，请检查 LLM_API_KEY / LLM_API_KEYS")
+
+        started = time.monotonic()
+        queue = list(candidates)
+        primary = queue.pop(0)
+        pending = {}
+        self._add(pending, self._submit(primary, call, with_context=True), primary)
+        hedge_delay = self._hedge_delay(primary) if self.hedge_enabled else None
+        hedged = False
+        failovers = 0
+        last_error = None
+
+        while pending:
+            timeout = None
+            if hedge_delay is not None and not hedged:
+                timeout = max(0.0, hedge_delay - (time.monotonic() - started))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 主请求超过 p95 还没回来：换一个端点再发一份 (只此一次)
+                hedged = True
+                backup = self._hedge_target(primary, queue)
+                if backup is None:
+                    continue
+                s.set("hedged", True)
+                self._add(pending, self._submit(backup, call, with_context=False), backup)
+                metrics.inc("llm_hedges_total", tier=tier)
+                logger.info("%s 超过 %.1fs 未响应，对冲到 %s", primary.label, hedge_delay, backup.label)
+                continue
+
+            for future in done:
+                endpoint, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    if not _is_retryable(e):
+                        # 请求本身的问题：换端点也一样，别的端点上还在跑的 (对冲) 也一并中止
+                        for other, (_, cancelled) in pending.items():
+                            other.cancel()
+                            cancelled.set()
+                        raise
+                    # 失败转移：还有没试过的端点就接着试 (此时前台只剩它，带上下文)
+                    if queue:
+                        backup = queue.pop(0)
+                        failovers += 1
+                        metrics.inc("llm_failovers_total", tier=tier)
+                        logger.warning("%s 调用失败 (%.80s)，切换到 %s", endpoint.label, e, backup.label)
+                        self._add(pending, self._submit(backup, call, with_context=not pending), backup)
+                    continue
+
+                # 谁先回来用谁：没开始的直接取消，已在执行的在下一个分片处中止
+                for other, (_, cancelled) in pending.items():
+                    other.cancel()
+                    cancelled.set()
+                if endpoint is not primary:
+                    metrics.inc("llm_hedge_wins_total" if hedged else "llm_failover_wins_total", tier=tier)
+                metrics.observe("llm_latency_seconds", time.monotonic() - started, tier=tier)
+                s.set("endpoint", endpoint.label)
+                s.set("failovers", failovers)
+                return result
+
+        raise last_error
+
+class _BoundGateway:
+    def __init__(self, gateway: LLMGateway, tools, tier: str):
+        self.gateway = gateway
+        self.tools = tools
+        self.tier = tier
+
+    def invoke(self, input, **kwargs):
+        return self.gateway._call(
+            self.tier,
+            lambda client: client.bind_tools(self.tools).stream(input, **kwargs),
+            input,
+            tools=[getattr(t, "name", str(t)) for t in self.tools]
+        )
+
+# ==========================================
+# 从环境变量组装端点池
+# ==========================================
+def _split(value: str):
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+def build_gateway_from_env() -> LLMGateway:
+    """
+    LLM_API_KEYS        多个 Key，逗号分隔 (没有就用 LLM_API_KEY)
+    LLM_MODEL_ID        default 档模型 (planner)
+    LLM_FAST_MODEL_ID   fast 档模型 (extractor / critic 等)，默认同 LLM_MODEL_ID
+    LLM_FALLBACK_MODELS 两档共用的备用模型，逗号分隔
+    """
+    keys = _split(os.getenv("LLM_API_KEYS")) or [os.getenv("LLM_API_KEY")]
+    default_model = os.getenv("LLM_MODEL_ID", "gemini-1.5-flash")
+    fast_model = os.getenv("LLM_FAST_MODEL_ID", default_model)
+    fallbacks = _split(os.getenv("LLM_FALLBACK_MODELS"))
+
+    key_states = {}
+    endpoints = []
+    for tier, primary_model in ((TIER_DEFAULT, default_model), (TIER_FAST, fast_model)):
+        for rank, model in enumerate(dict.fromkeys([primary_model] + fallbacks)):
+            for key in keys:
+                state = key_states.setdefault((model, key), _KeyState())
+                endpoints.append(LLMEndpoint(model, key, tier, state, rank))
+
+    return LLMGateway(
+        endpoints,
+        hedge_enabled=os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true",
+        hedge_min=float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1")),
+        hedge_max=float(os.getenv("LLM_HEDGE_MAX_SECONDS", "30")),
+    )
+
+# 单例：整个应用共用一个网关
+llm_gateway = build_gateway_from_env()
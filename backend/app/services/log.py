@@ -0,0 +1,126 @@
+# backend/app/services/log.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+
+# 日志子系统：替代散落各处的 print
+# 1. 非阻塞：业务线程只把记录丢进队列，由后台线程统一写 stdout (写不过来就丢弃并计数，不卡请求)
+# 2. 结构化：默认一行一个 JSON，带 request_id，方便日志系统按请求过滤
+# 3. 分级：LOG_LEVEL 控制输出，关掉的级别在 isEnabledFor 处就返回，几乎零开销
+#
+# 用法：
+#   logger = get_logger(__name__)
+#   logger.info("缓存命中", extra={"tool": name})     # 参数用 %s 延迟格式化，不要用 f-string
+#
+# 环境变量：
+#   LOG_LEVEL       DEBUG / INFO (默认) / WARNING / ERROR
+#   LOG_FORMAT      json (默认) / text (本地开发看着舒服)
+#   LOG_QUEUE_SIZE  队列上限 (默认 10000)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# 当前请求的 ID (main.py 在请求入口设置；线程池 / LangGraph 节点会复制上下文，自动带上)
+request_id_var = ContextVar("request_id", default=None)
+
+# LogRecord 自带的字段，其余都是调用方通过 extra 传进来的结构化字段
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+class _RequestIdFilter(logging.Filter):
+    """在调用方线程里取 request_id (后台线程拿不到请求上下文)"""
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} [{record.name}] {record.getMessage()}"
+        if getattr(record, "request_id", None):
+            line += f" (req={record.request_id})"
+        fields = {k: v for k, v in record.__dict__.items() if k not in _RESERVED and not k.startswith("_")}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满了就丢弃这条日志 (并计数)，绝不阻塞请求线程"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 异常堆栈必须在调用方线程里格式化 (之后 traceback 对象可能已经没了)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_queue_handler = None
+
+def setup_logging():
+    """给 app.* 日志挂上队列 Handler (重复调用无副作用)"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(_RequestIdFilter())
+
+    root = logging.getLogger("app")
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    root.addHandler(_queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # 进程退出前把队列里剩下的日志写完
+    atexit.register(_listener.stop)
+
+def get_logger(name: str) -> logging.Logger:
+    """模块级调用：logger = get_logger(__name__)；不在 app 包里的模块 (如 main.py) 也挂到 app 下"""
+    setup_logging()
+    if name != "app" and not name.startswith("app."):
+        name = f"app.{name}"
+    return logging.getLogger(name)
+
+def dropped_count() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
@@ -4,6 +4,10 @@ from langchain_core.tools import StructuredTool
 # 导入底层的“工人”
 from app.tools.search import search_tavily, get_weather
 from app.rag.retriever import search_knowledge_base
+from app.services.tracing import traced
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
 
 class MCPService:
     """
@@ -20,19 +24,25 @@ class MCPService:
         """
         # 1. 注册天气工具
         # StructuredTool.from_function 会自动读取函数的 docstring 作为工具说明
-        self._tools.append(StructuredTool.from_function(get_weather))
+        # traced: 开了追踪的请求会记录每次工具调用 (保留原函数签名和 docstring)
+        # 录制/回放不在这一层：挂在 cached_tool / batch_shared 下面，回放时缓存和批内共享照常工作
+        self._tools.append(StructuredTool.from_function(self._hook("get_weather", get_weather)))
 
         # 2. 注册搜索工具
-        self._tools.append(StructuredTool.from_function(search_tavily))
+        self._tools.append(StructuredTool.from_function(self._hook("search_tavily", search_tavily)))
 
         # 3. 注册 RAG 工具 (给它起个好听的名字让 AI 容易懂)
         self._tools.append(StructuredTool.from_function(
-            func=search_knowledge_base,
+            func=self._hook("search_local_guide", search_knowledge_base),
             name="search_local_guide",
-            description="查询本地独家旅行知识库。当用户询问推荐、隐秘景点或避雷指南时必须使用此工具。"
+            description="查询本地独家旅行知识库。当用户询问推荐、隐秘景点或避雷指南时必须使用此工具。city 填目的地城市名 (如 Hamilton)。"
         ))
         
-        print(f"🔌 [MCP Service] 已加载 {len(self._tools)} 个工具")
+        logger.info("已加载 %s 个工具", len(self._tools))
+
+    @staticmethod
+    def _hook(name: str, func):
+        return traced(f"tool:{name}", "tool")(func)
 
     def get_tools(self):
         """供 Agent 调用，获取所有工具列表"""
@@ -0,0 +1,100 @@
+# backend/app/services/metrics.py
+import threading
+from collections import deque
+
+# 轻量指标中心：计数器 / 仪表 / 耗时分布，进程内汇总，由 main.py 的 /metrics 导出
+# 不引入 prometheus_client，输出格式兼容 Prometheus 文本协议
+
+def _series(name: str, labels: dict) -> str:
+    """把指标名和标签拼成 Prometheus 风格的序列名：name{k="v"}"""
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+def _labels(*parts: str) -> str:
+    parts = [p for p in parts if p]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Summary:
+    """耗时/大小分布：累计 count/sum/max，分位数基于最近 N 个样本"""
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+        }
+
+class Metrics:
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _series(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_series(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _series(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary(self._window)
+            summary.observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {k: s.snapshot() for k, s in self._summaries.items()},
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式 (summary 只导出 count/sum 和 p50/p95)"""
+        snap = self.snapshot()
+        lines = [f"{k} {v}" for k, v in snap["counters"].items()]
+        lines += [f"{k} {v}" for k, v in snap["gauges"].items()]
+        for key, s in snap["summaries"].items():
+            name, _, labels = key.partition("{")
+            labels = labels.rstrip("}")
+            lines.append(f"{name}_count{_labels(labels)} {s['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {s['sum']}")
+            for quantile, field in (("0.5", "p50"), ("0.95", "p95")):
+                q_label = f'quantile="{quantile}"'
+                lines.append(f"{name}{_labels(labels, q_label)} {s[field]}")
+        return "\n".join(lines) + "\n"
+
+# 单例：整个进程共用
+metrics = Metrics()
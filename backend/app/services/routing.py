@@ -0,0 +1,233 @@
+# backend/app/services/routing.py
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.models.schemas import DayPlan, RouteSegment
+
+# 路线规划 (PRD2)：有了景点坐标后，不再让 LLM 编距离和顺序
+# 距离矩阵 / 最近邻 / 2-opt 全部按 "一批天数" 向量化计算，一份行程只算一次
+
+EARTH_RADIUS_KM = 6371.0
+
+# ==========================================
+# 1. 交通方式参数
+# ==========================================
+# speed: 平均速度 (km/h)；detour: 直线距离到实际路程的绕路系数；overhead: 等车/叫车的固定耗时 (分钟)
+TRANSPORT_PROFILES = {
+    "walk": {"speed": 4.8, "detour": 1.3, "overhead": 0.0, "label": "步行"},
+    "transit": {"speed": 18.0, "detour": 1.4, "overhead": 8.0, "label": "公共交通"},
+    "taxi": {"speed": 28.0, "detour": 1.3, "overhead": 4.0, "label": "打车"},
+}
+
+# 不同偏好下 "这么近就直接走过去" 的阈值 (km)；City Walk 模式 2km 内强制步行 (PRD2 2.1)
+WALK_THRESHOLD_KM = {"walk": 2.0, "transit": 0.8, "taxi": 0.5}
+
+# ==========================================
+# 2. 距离矩阵
+# ==========================================
+def haversine_matrix(coords: np.ndarray) -> np.ndarray:
+    """
+    两两球面距离 (km)
+    coords: (..., n, 2) 的 [纬度, 经度] (度)，返回 (..., n, n)
+    """
+    rad = np.radians(coords)
+    lat, lon = rad[..., :, None, 0], rad[..., :, None, 1]
+    dlat = lat - np.swapaxes(lat, -1, -2)
+    dlon = lon - np.swapaxes(lon, -1, -2)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(np.swapaxes(lat, -1, -2)) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def pack_days(coord_lists: List[List[Tuple[float, float]]]) -> Tuple[np.ndarray, np.ndarray]:
+    """把每天长度不同的坐标列表补齐成 (B, n, 2)，并返回每天的真实长度"""
+    lengths = np.array([len(c) for c in coord_lists], dtype=np.int64)
+    n = int(lengths.max()) if len(lengths) else 0
+    coords = np.zeros((len(coord_lists), n, 2))
+    for b, points in enumerate(coord_lists):
+        if points:
+            coords[b, :len(points)] = points
+    return coords, lengths
+
+# ==========================================
+# 3. 排序：最近邻 + 2-opt (起点固定为当天第一个景点，不回到起点)
+# ==========================================
+def nearest_neighbour(dist: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """批量最近邻：返回 (B, n) 的访问顺序，补齐位置保持原下标"""
+    batch, n = dist.shape[0], dist.shape[1]
+    rows = np.arange(batch)
+    tours = np.tile(np.arange(n), (batch, 1))
+    # 补齐出来的假节点一开始就标记为已访问
+    visited = np.arange(n)[None, :] >= lengths[:, None]
+    visited[:, 0] = True
+
+    for step in range(1, n):
+        d = dist[rows, tours[:, step - 1]].copy()
+        d[visited] = np.inf
+        nxt = np.argmin(d, axis=1)
+        active = step < lengths
+        tours[:, step] = np.where(active, nxt, step)
+        visited[rows[active], nxt[active]] = True
+    return tours
+
+def two_opt(dist: np.ndarray, tours: np.ndarray, lengths: np.ndarray, max_iter: int = 50) -> np.ndarray:
+    """
+    批量 2-opt：每轮一次性算出所有 (i, j) 翻转的收益，每天各取最优的一步
+    开放路径：翻转 tour[i..j]，只比较 (i-1, i) + (j, j+1) 两条边
+    """
+    batch, n = tours.shape
+    if n < 4:
+        return tours
+    tours = tours.copy()
+    b = np.arange(batch)[:, None, None]
+    idx = np.arange(1, n)                       # i, j 的取值范围 1..n-1
+    upper = idx[:, None] < idx[None, :]         # 只看 i < j
+    in_range = idx[None, None, :] < lengths[:, None, None]
+    has_next = (idx + 1)[None, None, :] < lengths[:, None, None]
+    next_idx = np.minimum(idx + 1, n - 1)
+
+    for _ in range(max_iter):
+        prev_i, cur_i = tours[:, idx - 1], tours[:, idx]
+        cur_j, next_j = tours[:, idx], tours[:, next_idx]
+
+        removed_ab = dist[b[:, :, 0], prev_i, cur_i][:, :, None]
+        added_ac = dist[b, prev_i[:, :, None], cur_j[:, None, :]]
+        removed_cd = dist[b[:, :, 0], cur_j, next_j][:, None, :]
+        added_bd = dist[b, cur_i[:, :, None], next_j[:, None, :]]
+
+        delta = added_ac - removed_ab + np.where(has_next, added_bd - removed_cd, 0.0)
+        delta = np.where(upper[None] & in_range, delta, 0.0)
+
+        flat = delta.reshape(batch, -1)
+        best = np.argmin(flat, axis=1)
+        improving = np.nonzero(flat[np.arange(batch), best] < -1e-9)[0]
+        if len(improving) == 0:
+            break
+        for row in improving:
+            i, j = divmod(int(best[row]), n - 1)
+            i, j = i + 1, j + 1
+            tours[row, i:j + 1] = tours[row, i:j + 1][::-1].copy()
+    return tours
+
+# ==========================================
+# 4. 交通耗时估算
+# ==========================================
+def choose_modes(dist_km: np.ndarray, preferred: str) -> np.ndarray:
+    """按偏好选每段的交通方式：太近的段直接步行 (City Walk 超过 2km 改坐公交)"""
+    preferred = preferred if preferred in TRANSPORT_PROFILES else "transit"
+    threshold = WALK_THRESHOLD_KM[preferred]
+    far_mode = "transit" if preferred == "walk" else preferred
+    return np.where(dist_km <= threshold, "walk", far_mode)
+
+def estimate_minutes(dist_km: np.ndarray, modes: np.ndarray) -> np.ndarray:
+    """每段耗时 (分钟)，dist_km 与 modes 形状相同"""
+    speed = np.empty_like(dist_km)
+    detour = np.empty_like(dist_km)
+    overhead = np.empty_like(dist_km)
+    for mode, profile in TRANSPORT_PROFILES.items():
+        mask = modes == mode
+        speed[mask], detour[mask], overhead[mask] = profile["speed"], profile["detour"], profile["overhead"]
+    return dist_km * detour / speed * 60 + overhead
+
+def leg_distances(pairs: np.ndarray) -> np.ndarray:
+    """(m, 2, 2) 的 [[起点], [终点]] 坐标 -> 每段距离 (km)"""
+    if not len(pairs):
+        return np.zeros(0)
+    return haversine_matrix(pairs)[:, 0, 1]
+
+# ==========================================
+# 5. 对外接口：整份行程一次算完
+# ==========================================
+def optimize_days(days: List[DayPlan], transport_mode: Optional[str] = "transit") -> List[DayPlan]:
+    """
+    给每天带坐标的景点排出游览顺序，并重建 route_segments (地点与交通交替)。
+    只调整景点之间的先后：餐厅、酒店、没查到坐标的景点等其他地点留在原来的位置，一个都不删。
+    只处理至少有 2 个带坐标景点的天；没有坐标的景点在 attractions 里按原顺序排在最后。
+    """
+    routable = [d for d in days if sum(a.location is not None for a in d.attractions) >= 2]
+    if not routable:
+        return days
+
+    located = [[a for a in d.attractions if a.location is not None] for d in routable]
+    coords, lengths = pack_days([[(a.location.latitude, a.location.longitude) for a in spots] for spots in located])
+    dist = haversine_matrix(coords)
+    tours = two_opt(dist, nearest_neighbour(dist, lengths), lengths)
+
+    stops_by_day = []
+    for b, day in enumerate(routable):
+        ordered = [located[b][k] for k in tours[b, :int(lengths[b])]]
+        unlocated = [a for a in day.attractions if a.location is None]
+        day.attractions = ordered + unlocated
+        stops_by_day.append(_place_stops(day.route_segments, ordered))
+
+    # 所有天里两端都有坐标的段一次性算距离和耗时
+    legs = [(b, k) for b, stops in enumerate(stops_by_day) for k in range(1, len(stops))
+            if stops[k - 1].coordinates and stops[k].coordinates]
+    pairs = np.array([[stops_by_day[b][k - 1].coordinates, stops_by_day[b][k].coordinates] for b, k in legs])
+    leg_km = leg_distances(pairs.reshape(-1, 2, 2))
+    modes = choose_modes(leg_km, transport_mode)
+    minutes = estimate_minutes(leg_km, modes)
+    computed = {leg: (float(leg_km[i]), str(modes[i]), float(minutes[i])) for i, leg in enumerate(legs)}
+
+    for b, day in enumerate(routable):
+        # LLM 原来写的交通段 (按 "从哪到哪" 索引)，算不出距离的段沿用它
+        original = {}
+        for prev, seg, nxt in zip(day.route_segments, day.route_segments[1:], day.route_segments[2:]):
+            if prev.type == "place" and seg.type == "transport" and nxt.type == "place":
+                original[(prev.name, nxt.name)] = seg
+
+        segments = []
+        for k, stop in enumerate(stops_by_day[b]):
+            if k > 0:
+                prev = stops_by_day[b][k - 1]
+                if (b, k) in computed:
+                    km, mode, mins = computed[(b, k)]
+                    segments.append(RouteSegment(
+                        type="transport",
+                        mode=mode,
+                        duration=f"{max(1, int(round(mins)))} min",
+                        instruction=f"{TRANSPORT_PROFILES[mode]['label']}约 {km:.1f} km 前往{stop.name}"
+                    ))
+                else:
+                    segments.append(original.get((prev.name, stop.name)) or RouteSegment(
+                        type="transport", mode=transport_mode, instruction=f"前往{stop.name}"
+                    ))
+            segments.append(stop)
+        day.route_segments = segments
+    return days
+
+def _place_stops(route_segments: List[RouteSegment], ordered: list) -> List[RouteSegment]:
+    """
+    当天的地点序列：原来排景点的位置按优化后的顺序依次填入景点，其余地点原样留在原位；
+    路线里没写到的景点接在最后一个景点位后面 (没有景点位就接在最后)
+    """
+    names = {spot.name for spot in ordered}
+    places = [s for s in route_segments if s.type == "place"]
+    originals = {s.name: s for s in places if s.name in names}
+
+    slots, taken = [], set()
+    for s in places:
+        if s.name in names and s.name not in taken:
+            taken.add(s.name)
+            slots.append(None)  # 景点位，稍后按新顺序填
+        else:
+            slots.append(s)
+    last = max((i for i, slot in enumerate(slots) if slot is None), default=len(slots) - 1)
+    slots[last + 1:last + 1] = [None] * (len(ordered) - len(taken))
+
+    spots = iter(ordered)
+    stops = []
+    for slot in slots:
+        if slot is not None:
+            stops.append(slot)
+            continue
+        spot = next(spots)
+        # 保留 LLM 给地点写的描述和 Emoji
+        old = originals.get(spot.name)
+        stops.append(RouteSegment(
+            type="place",
+            name=spot.name,
+            description=old.description if old and old.description else spot.description,
+            emoji=old.emoji if old else None,
+            coordinates=[spot.location.latitude, spot.location.longitude]
+        ))
+    return stops
@@ -0,0 +1,355 @@
+# backend/app/services/tracing.py
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 按需性能追踪：只有被选中的请求 (Header 打开或按采样率抽中) 才记录
+# 记录内容：Graph 节点 / 工具调用 / 缓存查询 / LLM 调用 组成的 Span 树 (耗时 + 数据大小)
+# 可选附带 Python 侧的性能剖析：
+#   sample   定时采样参与本次请求的线程调用栈 (可画火焰图)
+#   cprofile 每个 Graph 节点内开启 cProfile，结束后合并统计
+# 没开追踪时，每个埋点只多一次 ContextVar 读取
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+SAMPLE_INTERVAL = float(os.getenv("TRACE_SAMPLE_INTERVAL_MS", "5")) / 1000
+
+PROFILE_MODES = ("sample", "cprofile")
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+# 最近的追踪记录 (环形缓冲区，满了自动丢最旧的)
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+
+# cProfile 在 Python 3.12+ 是进程级的 (sys.monitoring)，同一时刻只能有一个在跑；
+# 并行的专家节点谁先拿到锁谁剖析，其余节点这次跳过
+_profiler_lock = threading.Lock()
+
+def payload_size(obj) -> int:
+    """粗略的数据大小 (字符数)，只在追踪开启时计算"""
+    if obj is None:
+        return 0
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    return len(str(obj))
+
+# ==========================================
+# 1. Span / Trace
+# ==========================================
+class Span:
+    __slots__ = ("id", "parent_id", "name", "kind", "start", "end", "thread_id", "attrs")
+
+    def __init__(self, name, kind, parent_id, attrs):
+        self.id = next(_span_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread_id = threading.get_ident()
+        self.attrs = attrs
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+class _NoopSpan:
+    """没开追踪时返回的空 Span，set() 什么也不做"""
+    def set(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    def __init__(self, name: str, profile: str = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.profile = profile if profile in PROFILE_MODES else None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self.active_threads = {}  # 线程 -> 正在进行的 Span 层数 (采样器只看 >0 的线程)
+        self.samples = {}       # 折叠后的调用栈 -> 采样次数
+        self.pstats_text = None
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def enter(self, thread_id):
+        with self._lock:
+            self.active_threads[thread_id] = self.active_threads.get(thread_id, 0) + 1
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            self.active_threads[span.thread_id] -= 1
+
+    def add_profile(self, profile: cProfile.Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    # ------------------------------------------
+    # 导出
+    # ------------------------------------------
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "spans": len(self.spans),
+            "profile": self.profile,
+        }
+
+    def to_dict(self) -> dict:
+        """Span 树 (按开始时间排序的扁平列表，带 parent_id)"""
+        return {
+            **self.summary(),
+            "span_list": [
+                {
+                    "id": s.id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "kind": s.kind,
+                    "start_ms": round((s.start - self.start) * 1000, 3),
+                    "duration_ms": round(s.duration * 1000, 3),
+                    "thread": s.thread_id,
+                    **({"attrs": s.attrs} if s.attrs else {}),
+                }
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+    def to_chrome(self) -> dict:
+        """Chrome Trace Event 格式，可直接拖进 chrome://tracing 或 Perfetto"""
+        events = [
+            {
+                "name": s.name,
+                "cat": s.kind,
+                "ph": "X",
+                "ts": round((s.start - self.start) * 1e6, 1),
+                "dur": round(s.duration * 1e6, 1),
+                "pid": 1,
+                "tid": s.thread_id,
+                "args": s.attrs,
+            }
+            for s in self.spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}
+
+    def to_folded(self) -> str:
+        """
+        火焰图折叠格式 (flamegraph.pl / speedscope 可读)：
+        开了 sample 剖析就输出采样到的 Python 调用栈，否则输出 Span 树 (值为自身耗时，微秒)
+        """
+        if self.samples:
+            return "\n".join(f"{stack} {count}" for stack, count in self.samples.items()) + "\n"
+
+        by_id = {s.id: s for s in self.spans}
+        child_time = {}
+        for s in self.spans:
+            if s.parent_id in by_id:
+                child_time[s.parent_id] = child_time.get(s.parent_id, 0.0) + s.duration
+
+        lines = []
+        for s in self.spans:
+            path, node = [], s
+            while node is not None:
+                path.append(node.name.replace(";", ":").replace(" ", "_"))
+                node = by_id.get(node.parent_id)
+            self_us = max(0, int((s.duration - child_time.get(s.id, 0.0)) * 1e6))
+            lines.append(f"{';'.join([self.name] + path[::-1])} {self_us}")
+        return "\n".join(lines) + "\n"
+
+    # ------------------------------------------
+    # 剖析
+    # ------------------------------------------
+    def _start_profiling(self):
+        if self.profile == "sample":
+            self._sampler = _StackSampler(self)
+            self._sampler.start()
+
+    def _stop_profiling(self):
+        if self._sampler:
+            self._sampler.stop()
+        if self._profiles:
+            out = io.StringIO()
+            stats = pstats.Stats(self._profiles[0], stream=out)
+            for extra in self._profiles[1:]:
+                stats.add(extra)
+            stats.sort_stats("cumulative").print_stats(60)
+            self.pstats_text = out.getvalue()
+            self._profiles = []
+
+class _StackSampler(threading.Thread):
+    """定时抓取参与本次请求的线程的调用栈 (只看正处在 Span 里的线程)"""
+
+    def __init__(self, trace: Trace):
+        super().__init__(name=f"trace-sampler-{trace.id}", daemon=True)
+        self.trace = trace
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            active = [t for t, depth in list(self.trace.active_threads.items()) if depth > 0]
+            for thread_id in active:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.trace.samples[key] = self.trace.samples.get(key, 0) + 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1)
+
+# ==========================================
+# 2. 开始 / 结束一次追踪
+# ==========================================
+def choose_mode(header_value: str = None):
+    """
+    根据请求头 X-Debug-Trace 决定是否追踪：
+      1/true -> 追踪；sample/cprofile -> 追踪并剖析；其余按 TRACE_SAMPLE_RATE 抽样
+    返回 (是否追踪, 剖析模式)
+    """
+    value = (header_value or "").strip().lower()
+    if value in PROFILE_MODES:
+        return True, value
+    if value in ("1", "true", "yes"):
+        return True, None
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE, None
+
+def start_trace(name: str, header_value: str = None):
+    """如果本次请求需要追踪，就开始一条 Trace 并设为当前上下文；否则返回 None"""
+    enabled, profile = choose_mode(header_value)
+    if not enabled:
+        return None
+    trace = Trace(name, profile)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    trace._start_profiling()
+    return trace
+
+def finish_trace(trace):
+    """结束追踪并放入环形缓冲区 (trace 为 None 时什么也不做)"""
+    if trace is None:
+        return
+    trace.end = time.perf_counter()
+    trace._stop_profiling()
+    with _traces_lock:
+        _traces.append(trace)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+
+def current_trace():
+    return _current_trace.get()
+
+def is_tracing() -> bool:
+    """当前请求是否在追踪 (用来跳过只有追踪才需要的计算，比如 payload 大小)"""
+    return _current_trace.get() is not None
+
+# ==========================================
+# 3. 埋点
+# ==========================================
+@contextmanager
+def span(name: str, kind: str = "internal", **attrs):
+    """with span("planner", "node") as s: ... s.set("output_bytes", n)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    s = Span(name, kind, parent.id if parent else None, attrs)
+    trace.enter(s.thread_id)
+    token = _current_span.set(s)
+
+    # cprofile 模式：Graph 节点单独剖析，结束后合并 (同一时刻只剖析一个节点)
+    profiler = None
+    if trace.profile == "cprofile" and kind == "node":
+        profiler = _start_node_profiler()
+        s.set("profiled", profiler is not None)
+    try:
+        yield s
+    except Exception as e:
+        s.set("error", repr(e)[:200])
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            _profiler_lock.release()
+            trace.add_profile(profiler)
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+        trace.add(s)
+
+def _start_node_profiler():
+    """拿不到剖析权 (别的节点或外部工具正在剖析) 就返回 None；追踪永远不能让请求失败"""
+    if sys.getprofile() is not None or not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 3.12+: Another profiling tool is already active
+        _profiler_lock.release()
+        return None
+    return profiler
+
+def traced(name: str = None, kind: str = "node"):
+    """函数装饰器版 span，额外记录返回值大小"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, kind) as s:
+                result = func(*args, **kwargs)
+                s.set("output_bytes", payload_size(result))
+                return result
+        return wrapper
+    return decorator
+
+# ==========================================
+# 4. 查询
+# ==========================================
+def list_traces() -> list:
+    with _traces_lock:
+        return [t.summary() for t in reversed(_traces)]
+
+def get_trace(trace_id: str):
+    with _traces_lock:
+        for t in _traces:
+            if t.id == trace_id:
+                return t
+    return None
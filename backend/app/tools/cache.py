@@ -3,22 +3,244 @@ import functools
 import json
 import hashlib
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import timedelta
 
-# 尝试导入 redis，如果没有安装或连不上，就用内存字典代替
-try:
-    import redis
-    # 尝试连接本地 Redis (默认端口 6379)
-    redis_client = redis.Redis(host='localhost', port=6379, db=0, socket_timeout=1)
-    redis_client.ping() # 测试连接
-    HAS_REDIS = True
-    print("✅ Redis 连接成功，启用高性能分布式缓存。")
-except Exception as e:
-    HAS_REDIS = False
-    print(f"⚠️ 未检测到 Redis 服务 ({str(e)})，降级使用本地内存缓存。")
-    # 内存缓存字典 (key: value)
-    _local_cache = {}
+from app.services.metrics import metrics
+from app.services.tracing import span
+from app.services.log import get_logger
+from app.services.cassette import cassette, CassetteMiss
+from app.tools.result import ToolResult
 
+logger = get_logger(__name__)
+
+# 缓存后端，通过环境变量 CACHE_BACKEND 选择：
+#   auto   (默认) 能连上 Redis 就用 Redis，否则用本地内存
+#   memory 进程内存 (每个 worker 各一份，重启清空)
+#   redis  分布式缓存
+#   sqlite 本机磁盘共享 (uvicorn --workers N 时所有 worker 共用一份，重启不丢)
+
+# ==========================================
+# 1. 三种后端 (统一接口: get / set)
+# ==========================================
+class MemoryBackend:
+    """进程内 LRU 缓存，带 TTL 和条目上限"""
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._data[key] = (time.time() + ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+class RedisBackend:
+    """Redis 分布式缓存 (多台机器共享)"""
+    name = "redis"
+
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl_seconds):
+        self._client.setex(key, timedelta(seconds=ttl_seconds), value)
+
+class SQLiteBackend:
+    """
+    本机磁盘缓存：SQLite WAL 模式，多进程可以同时读、排队写。
+    每个线程一条连接；按最近访问时间淘汰，总大小不超过 max_bytes。
+    """
+    name = "sqlite"
+
+    # 读取时最多每隔这么久更新一次访问时间，避免每次读都变成写
+    TOUCH_INTERVAL = 60
+    # 每写这么多次检查一次过期和总大小
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: 每条语句自动提交，写锁持有时间最短
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at < now:
+            return None
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            self._conn().execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key, value, ttl_seconds):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), now + ttl_seconds, now)
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """删掉过期条目；总大小超限时，从最久没访问的开始删"""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            " SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS running FROM cache)"
+            " WHERE running > ?)",
+            (self.max_bytes,)
+        )
+
+def _create_backend():
+    choice = os.getenv("CACHE_BACKEND", "auto").lower()
+
+    if choice == "sqlite":
+        path = os.getenv("CACHE_DB_PATH", "./tool_cache.db")
+        max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        logger.info("启用 SQLite 共享磁盘缓存: %s", path)
+        return SQLiteBackend(path, max_bytes)
+
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    if choice == "memory":
+        logger.info("启用本地内存缓存")
+        return MemoryBackend(max_entries)
+
+    # 尝试导入 redis，如果没有安装或连不上，就用内存缓存代替
+    try:
+        import redis
+        # 默认连接本地 Redis (端口 6379)
+        redis_client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), socket_timeout=1)
+        redis_client.ping() # 测试连接
+        logger.info("Redis 连接成功，启用分布式缓存")
+        return RedisBackend(redis_client)
+    except Exception as e:
+        logger.warning("未检测到 Redis 服务 (%s)，降级使用本地内存缓存", e)
+        return MemoryBackend(max_entries)
+
+cache_backend = _create_backend()
+
+# ==========================================
+# 2. 批量任务内的调用共享
+# ==========================================
+class SharedCalls:
+    """
+    一批行程共享的工具调用：同一个调用 (同名同参数) 在整批里只真正执行一次，
+    并发的相同调用等第一个的结果。不受缓存 TTL 影响，批次结束就丢弃。
+    失败 (异常或 ok=False) 只分给正在等的调用，不留在表里：之后的调用重新执行
+    (经过 cached_tool 的短负缓存)，一次偶发故障不会连累整批同城的行程。
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.calls = 0    # 真正执行的调用数
+        self.shared = 0   # 直接复用的调用数
+
+    def run(self, key, func):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+                self.calls += 1
+            else:
+                self.shared += 1
+        if owner:
+            try:
+                result = func()
+                if isinstance(result, ToolResult) and not result.ok:
+                    self._forget(key, future)
+                future.set_result(result)
+            except BaseException as e:
+                self._forget(key, future)
+                future.set_exception(e)
+        return future.result()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+_shared_calls = ContextVar("shared_tool_calls", default=None)
+
+@contextmanager
+def shared_tool_calls(shared: SharedCalls):
+    """with shared_tool_calls(job.shared): graph.invoke(...)  (LangGraph 节点线程会继承这个上下文)"""
+    token = _shared_calls.set(shared)
+    try:
+        yield shared
+    finally:
+        _shared_calls.reset(token)
+
+def batch_shared(func):
+    """不走缓存、只在批量任务里去重的装饰器 (给本地检索这类本身很快、不值得缓存的工具用)"""
+    name = func.__name__
+    # 录制/回放挂在去重的下面：回放时批内共享照常生效
+    func = cassette.wrap_tool(name, func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        shared = _shared_calls.get()
+        if shared is None:
+            return func(*args, **kwargs)
+        return shared.run(get_cache_key(name, args, kwargs), lambda: func(*args, **kwargs))
+    return wrapper
+
+# ==========================================
+# 3. 缓存装饰器
+# ==========================================
 def get_cache_key(func_name, args, kwargs):
     """生成唯一的缓存 Key"""
     # 把参数序列化，防止字典顺序不同导致 key 不同
@@ -27,38 +249,76 @@ def get_cache_key(func_name, args, kwargs):
     hash_str = hashlib.md5(arg_str.encode()).hexdigest()
     return f"cache:{func_name}:{hash_str}"
 
-def cached_tool(ttl_seconds=300):
+# 失败结果的缓存时间：足够挡住一波重试风暴，又不会让一次临时故障影响太久
+NEGATIVE_TTL_SECONDS = int(os.getenv("CACHE_NEGATIVE_TTL", "30"))
+
+def cached_tool(ttl_seconds=300, negative_ttl_seconds=None):
     """
     缓存装饰器：给工具加上记忆能力
-    :param ttl_seconds: 缓存有效期 (默认 5 分钟)
+    :param ttl_seconds: 成功结果的缓存有效期 (默认 5 分钟)
+    :param negative_ttl_seconds: 失败结果的缓存有效期 (默认 CACHE_NEGATIVE_TTL)
+    被装饰的函数返回 ToolResult (普通返回值会包成成功结果，抛出的异常会包成失败结果)
     """
     def decorator(func):
+        name = func.__name__
+        # 录制/回放只包住真正的上游调用 (缓存的下面)：回放时缓存层照常工作，
+        # 录下来的也只有当时真正打到 API 的调用
+        upstream = cassette.wrap_tool(name, func)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # 1. 生成 Key
-            cache_key = get_cache_key(func.__name__, args, kwargs)
-            
+            cache_key = get_cache_key(name, args, kwargs)
+
+            # 批量任务里：整批共享同一次调用
+            shared = _shared_calls.get()
+            if shared is not None:
+                return shared.run(cache_key, lambda: lookup(cache_key, args, kwargs))
+            return lookup(cache_key, args, kwargs)
+
+        def lookup(cache_key, args, kwargs):
             # 2. 查缓存
-            if HAS_REDIS:
-                cached_result = redis_client.get(cache_key)
-                if cached_result:
-                    print(f"⚡ [Cache Hit] 命中缓存: {func.__name__}")
-                    return cached_result.decode('utf-8')
-            else:
-                if cache_key in _local_cache:
-                    print(f"⚡ [Local Cache Hit] 命中内存缓存: {func.__name__}")
-                    return _local_cache[cache_key]
+            with span(f"cache:{name}", "cache", backend=cache_backend.name) as s:
+                cached_result = cache_backend.get(cache_key)
+                s.set("hit", cached_result is not None)
+            if cached_result is not None:
+                result = ToolResult.from_json(cached_result)
+                if result.ok:
+                    metrics.inc("cache_hits_total", tool=name)
+                    logger.debug("缓存命中", extra={"tool": name, "backend": cache_backend.name})
+                else:
+                    # 最近刚失败过：直接返回失败，不去打 API，也不算正常命中
+                    metrics.inc("cache_negative_hits_total", tool=name)
+                    logger.debug("近期调用失败，暂不重试", extra={"tool": name})
+                return result
 
             # 3. 没命中，执行原函数
-            print(f"🐢 [Cache Miss] 调用 API: {func.__name__}")
-            result = func(*args, **kwargs)
-            
-            # 4. 存入缓存
-            if HAS_REDIS:
-                redis_client.setex(cache_key, timedelta(seconds=ttl_seconds), str(result))
+            metrics.inc("cache_misses_total", tool=name)
+            logger.debug("缓存未命中，调用 API", extra={"tool": name})
+            with span(f"api:{name}", "api") as s:
+                try:
+                    result = upstream(*args, **kwargs)
+                except CassetteMiss:
+                    # 回放对不上录制：要让调用方知道，不能当成一次普通失败缓存起来
+                    raise
+                except Exception as e:
+                    result = ToolResult.failure(f"{name} 调用失败: {e}")
+                if not isinstance(result, ToolResult):
+                    result = ToolResult.success(result)
+                s.set("ok", result.ok)
+                s.set("output_bytes", len(result.data))
+
+            # 4. 存入缓存 (失败只存很短时间)
+            if result.ok:
+                if result.empty:
+                    metrics.inc("tool_empty_results_total", tool=name)
+                cache_backend.set(cache_key, result.to_json(), ttl_seconds)
             else:
-                _local_cache[cache_key] = str(result)
-                
+                metrics.inc("tool_failures_total", tool=name)
+                negative_ttl = NEGATIVE_TTL_SECONDS if negative_ttl_seconds is None else negative_ttl_seconds
+                if negative_ttl > 0:
+                    cache_backend.set(cache_key, result.to_json(), negative_ttl)
+
             return result
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
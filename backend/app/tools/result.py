@@ -0,0 +1,44 @@
+# backend/app/tools/result.py
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass
+class ToolResult:
+    """
+    工具的结构化返回：成功/失败分开表示，缓存层据此区别对待
+    (失败只短暂缓存、不当作正常命中；空结果是正常结果，照常缓存)
+    str(result) 就是给 LLM 看的文本，所以节点和 ToolNode 可以直接当字符串用。
+    """
+    ok: bool
+    data: str = ""
+    error: Optional[str] = None
+
+    @classmethod
+    def success(cls, data) -> "ToolResult":
+        return cls(ok=True, data="" if data is None else str(data))
+
+    @classmethod
+    def failure(cls, error) -> "ToolResult":
+        return cls(ok=False, error=str(error))
+
+    @property
+    def empty(self) -> bool:
+        return self.ok and not self.data.strip()
+
+    def __str__(self) -> str:
+        return self.data if self.ok else (self.error or "工具调用失败")
+
+    def to_json(self) -> str:
+        return json.dumps({"ok": self.ok, "data": self.data, "error": self.error}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "ToolResult":
+        """从缓存里读回来；旧版本缓存的纯字符串按成功结果处理"""
+        try:
+            payload = json.loads(raw)
+            if isinstance(payload, dict) and "ok" in payload:
+                return cls(ok=bool(payload["ok"]), data=payload.get("data") or "", error=payload.get("error"))
+        except (TypeError, ValueError):
+            pass
+        return cls.success(raw)
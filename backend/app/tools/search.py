@@ -2,6 +2,9 @@
 import os
 import requests
 from dotenv import load_dotenv, find_dotenv
+from app.services.log import get_logger
+
+logger = get_logger(__name__)
 
 # --- 1. 关键修复：先加载环境变量，再初始化工具 ---
 # 强制加载 .env (防止找不到 Key)
@@ -9,15 +12,23 @@ load_dotenv(find_dotenv(usecwd=True))
 
 # 检查 Key 是否存在 (方便调试)
 if not os.getenv("TAVILY_API_KEY"):
-    print("❌ 错误: 未找到 TAVILY_API_KEY，请检查 .env 文件！")
+    logger.error("未找到 TAVILY_API_KEY，请检查 .env 文件")
 
 # 尝试导入新版 Tavily (消灭黄色警告)
 from langchain_tavily import TavilySearch
 from app.tools.cache import cached_tool # 导入我们的缓存装饰器
+from app.tools.result import ToolResult
 
 # --- 2. 初始化工具 ---
-# 只有在 load_dotenv 之后执行这一行，才能读到 Key
-_tavily_client = TavilySearch(max_results=5)
+# 第一次搜索时才创建 (在 load_dotenv 之后，才能读到 Key)；
+# 没有 Key 也能正常导入，比如离线回放磁带的时候
+_tavily_client = None
+
+def get_tavily_client():
+    global _tavily_client
+    if _tavily_client is None:
+        _tavily_client = TavilySearch(max_results=5)
+    return _tavily_client
 
 @cached_tool(ttl_seconds=3600) # 缓存 1 小时
 def search_tavily(query: str):
@@ -26,13 +37,13 @@ def search_tavily(query: str):
     """
     try:
         # Tavily 返回的是列表，我们需要把它转成字符串给 LLM
-        results = _tavily_client.invoke(query)
+        results = get_tavily_client().invoke(query)
         content_list = []
         for res in results:
             content_list.append(f"- {res.get('content', '')} (来源: {res.get('url', '')})")
-        return "\n".join(content_list)
+        return ToolResult.success("\n".join(content_list))
     except Exception as e:
-        return f"搜索失败: {str(e)}"
+        return ToolResult.failure(f"搜索失败: {str(e)}")
 
 @cached_tool(ttl_seconds=1800) # 天气变动快，缓存 30 分钟
 def get_weather(city: str):
@@ -50,9 +61,9 @@ def get_weather(city: str):
                 data = response.json()
                 desc = data['weather'][0]['description']
                 temp = data['main']['temp']
-                return f"{city} 实时天气: {desc}, 温度: {temp}°C"
+                return ToolResult.success(f"{city} 实时天气: {desc}, 温度: {temp}°C")
         except Exception as e:
-            print(f"⚠️ OpenWeather 调用失败，切换到搜索模式: {e}")
+            logger.warning("OpenWeather 调用失败，切换到搜索模式: %s", e)
     
     # 2. 回退方案：用 Tavily 搜
     return search_tavily(f"current weather in {city}")
@@ -61,9 +72,10 @@ def get_weather(city: str):
 if __name__ == "__main__":
     print("🔍 开始测试工具层...")
     
-    print("\n--- Test 1: 第一次调用 (应该显示 [Cache Miss]) ---")
+    # LOG_LEVEL=DEBUG 时能看到缓存命中/未命中日志
+    print("\n--- Test 1: 第一次调用 (应该是缓存未命中) ---")
     # 搜一个冷门点的，防止你刚才搜过 Hamilton 已经在缓存里了
     print(get_weather("Banff, Alberta"))
     
-    print("\n--- Test 2: 第二次调用 (应该显示 [Cache Hit]) ---")
+    print("\n--- Test 2: 第二次调用 (应该命中缓存) ---")
     print(get_weather("Banff, Alberta"))
\ No newline at end of file
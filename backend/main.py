@@ -1,15 +1,38 @@
 # backend/main.py
-from fastapi import FastAPI, HTTPException
+import os
+import time
+import uuid
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware # 👈 引入 CORS 中间件
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from anyio import from_thread
 from pydantic import BaseModel
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv, find_dotenv
 
 # 导入我们的图
-from app.agents.graph import graph
+from app.agents.graph import graph, batch_graph
+from app.agents.checkpoint import session_config
+from app.agents.plan_parser import IncrementalPlanParser, parse_trip_plan, plan_to_markdown
+from app.agents.artifacts import artifacts
+from app.agents.router import classify_request, ROUTE_FAST, ROUTE_FULL
+from app.agents.fast_path import run_fast_path
+from app.services.geocoding import get_geocoder
+from app.services.routing import optimize_days
+from app.services.metrics import metrics
+from app.services import tracing
+from app.services.log import get_logger, request_id_var, dropped_count
+from app.api.admission import admission, AdmissionRejected, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from app.api.batch import BatchRunner, BATCH_MAX_ITEMS
+from app.api.encoding import dumps, parse_fields, wants, select_fields, FastJSONResponse
+from app.models.schemas import TripRequest
 
 load_dotenv(find_dotenv(usecwd=True))
 
+logger = get_logger("main")
+
 app = FastAPI(title="Travel Agent AI", version="1.0")
 
 # ==========================================
@@ -22,44 +45,423 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # 允许所有方法 (POST, GET...)
     allow_headers=["*"], # 允许所有 Header
+    expose_headers=["X-Trace-Id", "X-Request-Id", "X-Batch-Id"], # 让前端拿到追踪 ID / 请求 ID
 )
 
+# 调试接口开关：/debug/* 会暴露 Prompt、工具参数，默认关闭，本地排查时再打开
+DEBUG_TRACES_ENABLED = os.getenv("DEBUG_TRACES_ENABLED", "false").lower() == "true"
+# 最终回复里补坐标最多等 Nominatim 几秒 (1 次/秒限流，地点多时不设上限会拖很久)；没查完的下次就在缓存里了
+GEOCODE_DEADLINE = float(os.getenv("GEOCODE_DEADLINE", "5"))
+
 class ChatRequest(BaseModel):
     message: str
+    # 多轮对话：带上上一次返回的 session_id，就能在原行程上修改
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[TripRequest]
+    # stream: 按完成顺序以 NDJSON 流式返回；file: 后台运行，结果写入文件 (立即返回 job_id)
+    output: Literal["stream", "file"] = "stream"
+
+# 会输出行程 JSON 的节点 (流式接口只解析它们的 token)
+PLAN_NODES = {"planner", "replanner"}
+
+def enrich_days(days: list, city: str = None, transport_mode: str = "transit", fetch: bool = True):
+    """
+    补上地图坐标，再按坐标排游览顺序、算交通耗时 (失败也不影响文字行程)
+    fetch=False: 只用缓存里的坐标，没有的后台去查 (流式推送用，不等 Nominatim)
+    fetch=True: 最多等 GEOCODE_DEADLINE 秒；调用方不要占着准入名额调用它
+    """
+    try:
+        get_geocoder().geocode_days(days, city, fetch=fetch, timeout=GEOCODE_DEADLINE)
+        optimize_days(days, transport_mode)
+    except Exception as e:
+        logger.warning("坐标/路线计算失败，地图将不显示: %s", e)
+
+def transport_mode_of(state: dict) -> str:
+    request = state.get("request")
+    return request.transport_mode if request else "transit"
+
+def city_of(state: dict):
+    request = state.get("request")
+    return request.city if request else None
+
+def build_response(session_id: str, final_state: dict, fields: list = None) -> dict:
+    """把 Graph 最终状态整理成返回给前端的结构 (fields 没选 details 就不去取情报正文)"""
+    final_plan = final_state.get("final_plan")
+    # degraded: 行程没有通过审核 (unreviewed)，或者最后的草稿根本解析不出来 (invalid)
+    degraded = None
+    if final_plan is None:
+        # 审核一直没过 / 修改后的 JSON 解析失败：再试着解析最后一版草稿，绝不把模型的原始输出当回复
+        try:
+            final_plan = parse_trip_plan(artifacts.resolve(final_state.get("draft_plan")) or "")
+            degraded = "unreviewed"
+        except Exception as e:
+            logger.warning("最后一版草稿无法解析为行程: %s", e)
+            degraded = "invalid"
+
+    if final_plan:
+        # 流式接口里每天已经查过一遍坐标，这里基本都是缓存命中
+        enrich_days(final_plan.days, final_plan.city, transport_mode_of(final_state))
+        response_text = plan_to_markdown(final_plan)
+        if degraded:
+            response_text = "⚠️ 这份行程没有通过最终审核，仅供参考。\n\n" + response_text
+    else:
+        response_text = "抱歉，这次没能生成有效的行程，请换个说法再试一次。"
+    
+    response = {
+        "session_id": session_id,
+        "reply": response_text,
+        "plan": final_plan.model_dump() if final_plan else None,
+        "degraded": degraded,
+    }
+    if wants(fields, "details"):
+        response["details"] = {
+            "path": ROUTE_FULL,
+            "weather": artifacts.resolve(final_state.get("weather_info")),
+            "attractions": artifacts.resolve(final_state.get("attractions_info")),
+            "critique": final_state.get("critique_comments"),
+            "followup": final_state.get("followup_type"),
+            # 规划师重写过几次 (旧草稿以差异的形式留在会话里)
+            "revisions": len(final_state.get("draft_history") or []),
+        }
+    return response
+
+def run_batch_item(request: TripRequest) -> dict:
+    """批量任务里的一项：结构化需求直接交给三个专家 (跳过提取)，不开会话"""
+    return batch_graph.invoke({"request": request, "critique_count": 0})
+
+def finish_batch_item(final_state: dict) -> dict:
+    """归还名额之后再整理结果 (补坐标要等 Nominatim)"""
+    response = build_response(None, final_state, fields=["reply", "plan", "degraded"])
+    return {"reply": response["reply"], "plan": response["plan"], "degraded": response["degraded"]}
+
+batch_runner = BatchRunner(run_batch_item, finish_item=finish_batch_item)
+
+def build_fast_response(reply: str) -> dict:
+    """快速通道的返回：没有结构化行程，也不开会话"""
+    return {"session_id": None, "reply": reply, "plan": None, "details": {"path": ROUTE_FAST}}
+
+def has_draft(session_id: Optional[str]) -> bool:
+    """会话里确实已经有行程草稿 (session_id 是调用方传的，不查 checkpointer 不能信)"""
+    if not session_id:
+        return False
+    return bool(graph.get_state(session_config(session_id)).values.get("draft_plan"))
+
+def route_of(req: ChatRequest, followup: bool) -> Optional[str]:
+    """
+    续聊一定走完整 Graph (要用会话里的情报)；新请求先按规则做复杂度分类
+    规则拿不准返回 None：要问小模型，等拿到名额后再问 (见 classify_request)
+    """
+    if followup:
+        return ROUTE_FULL
+    return classify_request(req.message, use_llm=False)
+
+def sse(event: str, data) -> bytes:
+    """按 Server-Sent Events 格式打包一条消息"""
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+def priority_of(request: Request, route: str, followup: bool) -> int:
+    """续聊和快速通道插队 (只需 1~2 次 LLM 调用)；调用方可以用 X-Priority: low 主动降级"""
+    if request.headers.get("X-Priority", "").lower() == "low":
+        return PRIORITY_LOW
+    return PRIORITY_HIGH if followup or route == ROUTE_FAST else PRIORITY_NORMAL
+
+def debug_trace_header(request: Request) -> Optional[str]:
+    """调试开关关闭时忽略 X-Debug-Trace (否则谁都能让服务开 cProfile)，只按 TRACE_SAMPLE_RATE 抽样"""
+    return request.headers.get("X-Debug-Trace") if DEBUG_TRACES_ENABLED else None
+
+def bind_request_id(request: Request) -> str:
+    """给本次请求分配 ID (调用方传了 X-Request-Id 就沿用)，之后的日志都会带上它"""
+    request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    响应发送完 (或中途失败、客户端断开) 后一定调用 on_close。
+    不能只靠生成器的 finally：生成器还没开始迭代就断开的话，finally 根本不会执行，名额就泄漏了
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+def rejected(e: AdmissionRejected) -> HTTPException:
+    logger.warning("请求被拒绝 (%s): %s", e.status_code, e.reason)
+    return HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
 
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "Travel Agent Backend is Running!"}
 
+@app.get("/metrics")
+def metrics_endpoint(format: str = "json"):
+    """运行指标 (排队深度、等待时间等)；?format=prometheus 输出文本格式"""
+    metrics.set_gauge("log_records_dropped", dropped_count())
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus())
+    return metrics.snapshot()
+
+# ==========================================
+# 🔍 按需追踪：请求带上 X-Debug-Trace: 1 | sample | cprofile (或按 TRACE_SAMPLE_RATE 抽样)
+# 请求头只在 DEBUG_TRACES_ENABLED 时生效；响应头 X-Trace-Id 就是追踪 ID
+# ==========================================
+@app.get("/debug/traces")
+def list_traces_endpoint():
+    """最近的追踪记录 (新的在前)"""
+    if not DEBUG_TRACES_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return tracing.list_traces()
+
+@app.get("/debug/traces/{trace_id}")
+def trace_endpoint(trace_id: str, format: str = "json"):
+    """
+    format=json     Span 树
+    format=chrome   Chrome Trace (chrome://tracing / Perfetto)
+    format=folded   火焰图折叠格式 (flamegraph.pl / speedscope)
+    format=pstats   cProfile 统计 (需要 X-Debug-Trace: cprofile)
+    """
+    if not DEBUG_TRACES_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="追踪记录不存在 (可能已被新的记录挤掉)")
+    if format == "chrome":
+        return trace.to_chrome()
+    if format == "folded":
+        return PlainTextResponse(trace.to_folded())
+    if format == "pstats":
+        return PlainTextResponse(trace.pstats_text or "本次追踪没有开启 cProfile\n")
+    return trace.to_dict()
+
 @app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
-    print(f"📨 收到前端请求: {req.message}")
+async def chat_endpoint(req: ChatRequest, request: Request, fields: Optional[str] = None):
+    """fields: 只返回部分字段，如 ?fields=reply 或 ?fields=session_id,reply,details.critique"""
+    headers = {"X-Request-Id": bind_request_id(request)}
+    fields = parse_fields(fields)
+    logger.info("收到请求", extra={"session_id": req.session_id, "message_chars": len(req.message)})
+    logger.debug("用户消息: %s", req.message)
+    trace = tracing.start_trace("/chat", debug_trace_header(request))
+    if trace:
+        headers["X-Trace-Id"] = trace.id
+    
+    # 没有 session_id 就开一个新会话
+    session_id = req.session_id or uuid.uuid4().hex
     
+    # 只需要传入新消息，其余 State (情报、草稿) 由 checkpointer 从会话里恢复
     initial_state = {
         "messages": [HumanMessage(content=req.message)]
     }
     
     try:
-        # 运行 Graph
-        final_state = graph.invoke(initial_state)
+        # 随便带个 session_id 不能插队：会话里要真有草稿才算续聊
+        followup = await run_in_threadpool(has_draft, req.session_id)
+        route = route_of(req, followup)
+        started = time.monotonic()
         
-        # 提取结果
-        response_text = final_state.get("draft_plan", "生成失败")
-        # 如果有 critique_comments 且不是 PASS，说明最后还在纠结，但也返回出来
+        # 先排队拿名额，再在线程池里运行 (不阻塞事件循环)
+        async with admission.slot(priority_of(request, route, followup)):
+            if route is None:
+                route = await run_in_threadpool(classify_request, req.message)
+            if route == ROUTE_FAST:
+                # 简单问题：单 Agent + 工具，一般 1~2 次 LLM 调用
+                response = build_fast_response(await run_in_threadpool(run_fast_path, req.message))
+            else:
+                final_state = await run_in_threadpool(graph.invoke, initial_state, session_config(session_id))
         
-        return {
-            "reply": response_text,
-            "details": {
-                "weather": final_state.get("weather_info"),
-                "attractions": final_state.get("attractions_info"),
-                "critique": final_state.get("critique_comments")
-            }
-        }
+        if route == ROUTE_FULL:
+            # 提取结果
+            # 如果有 critique_comments 且不是 PASS，说明最后还在纠结，但也返回出来
+            response = await run_in_threadpool(build_response, session_id, final_state, fields)
         
+        metrics.observe("chat_latency_seconds", time.monotonic() - started, path=route)
+        return FastJSONResponse(select_fields(response, fields), headers=headers)
+        
+    except AdmissionRejected as e:
+        raise rejected(e)
     except Exception as e:
-        print(f"❌ 后端处理出错: {e}")
+        logger.exception("后端处理出错: %s", e)
         # 返回 500 错误给前端
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        tracing.finish_trace(trace)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest, request: Request, fields: Optional[str] = None):
+    """
+    流式版 /chat (SSE)：规划师每写完一天 (或一段路线) 就推给前端
+    事件: session -> (reset -> segment/day ...)* -> done | error
+    fields 只作用于 done 事件 (同 /chat)
+    """
+    request_id = bind_request_id(request)
+    fields = parse_fields(fields)
+    logger.info("收到流式请求", extra={"session_id": req.session_id, "message_chars": len(req.message)})
+    logger.debug("用户消息: %s", req.message)
+    session_id = req.session_id or uuid.uuid4().hex
+    config = session_config(session_id)
+    initial_state = {"messages": [HumanMessage(content=req.message)]}
+    
+    def fast_stream():
+        # 快速通道没有逐天的行程，直接给最终回答
+        started = time.monotonic()
+        try:
+            yield sse("done", select_fields(build_fast_response(run_fast_path(req.message)), fields))
+        except Exception as e:
+            logger.exception("快速通道出错: %s", e)
+            yield sse("error", {"detail": str(e)})
+        metrics.observe("chat_latency_seconds", time.monotonic() - started, path=ROUTE_FAST)
+    
+    def event_stream():
+        started = time.monotonic()
+        yield sse("session", {"session_id": session_id})
+        parser, step = None, None
+        # 续聊时交通偏好/城市在会话里；新会话等 extractor 提取出来后再更新
+        session_state = graph.get_state(config).values
+        transport_mode, city = transport_mode_of(session_state), city_of(session_state)
+        
+        try:
+            for mode, payload in graph.stream(initial_state, config, stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if metadata.get("langgraph_node") not in PLAN_NODES or not isinstance(chunk.content, str):
+                        continue
+                    # Critic 打回后规划师会重写一遍：通知前端丢掉旧草稿
+                    if metadata.get("langgraph_step") != step:
+                        step = metadata.get("langgraph_step")
+                        parser = IncrementalPlanParser()
+                        yield sse("reset", {"node": metadata.get("langgraph_node")})
+                    for event in parser.feed(chunk.content):
+                        yield sse(event["type"], _jsonable(event, transport_mode, city))
+                else:
+                    # 节点跑完的完整输出：如果模型没有逐 token 返回，就在这里一次性解析
+                    for node, update in payload.items():
+                        if (update or {}).get("request"):
+                            transport_mode, city = update["request"].transport_mode, update["request"].city
+                        draft = artifacts.resolve((update or {}).get("draft_plan")) if node in PLAN_NODES else None
+                        if draft and (parser is None or parser.text != draft):
+                            parser, step = IncrementalPlanParser(), None
+                            yield sse("reset", {"node": node})
+                            for event in parser.feed(draft):
+                                yield sse(event["type"], _jsonable(event, transport_mode, city))
+                        if node in PLAN_NODES:
+                            # 下一次规划节点的 token 一定属于新的一轮
+                            step = None
+            
+            final_state = graph.get_state(config).values
+            # 图跑完就归还名额 (回到事件循环线程里还)，补坐标等 Nominatim 时不占着它
+            from_thread.run_sync(release_slot)
+            yield sse("done", select_fields(build_response(session_id, final_state, fields), fields))
+        except Exception as e:
+            logger.exception("流式处理出错: %s", e)
+            yield sse("error", {"detail": str(e)})
+        metrics.observe("chat_latency_seconds", time.monotonic() - started, path=ROUTE_FULL)
+    
+    # 追踪从分类开始，到响应结束 (ClosingStreamingResponse 的 on_close) 为止
+    trace = tracing.start_trace("/chat/stream", debug_trace_header(request))
+    try:
+        followup = await run_in_threadpool(has_draft, req.session_id)
+        route = route_of(req, followup)
+        # 名额在开始推流前拿到 (拿不到直接 429/503)，推流结束或客户端断开时归还
+        started = await admission.acquire(priority_of(request, route, followup))
+    except AdmissionRejected as e:
+        tracing.finish_trace(trace)
+        raise rejected(e)
+    except Exception:
+        tracing.finish_trace(trace)
+        raise
+    
+    released = closed = False
+    
+    def release_slot():
+        # 推流里提前归还 (见 event_stream) 和 on_close 都会调用：只归还一次
+        nonlocal released
+        if not released:
+            released = True
+            admission.release(started)
+    
+    def on_close():
+        # 正常结束、出错、客户端在推流开始前就断开：无论哪条路都只归还一次
+        nonlocal closed
+        if not closed:
+            closed = True
+            release_slot()
+            tracing.finish_trace(trace)
+    
+    try:
+        if route is None:
+            route = await run_in_threadpool(classify_request, req.message)
+        stream = fast_stream() if route == ROUTE_FAST else event_stream()
+        headers = {"X-Request-Id": request_id}
+        if trace:
+            headers["X-Trace-Id"] = trace.id
+        return ClosingStreamingResponse(iterate_in_threadpool(stream), on_close=on_close,
+                                        media_type="text/event-stream", headers=headers)
+    except BaseException:
+        on_close()
+        raise
+
+# ==========================================
+# 📦 批量规划
+# ==========================================
+def ndjson(data) -> bytes:
+    return dumps(data) + b"\n"
+
+async def batch_stream(job):
+    """每完成一项推一行 {"type": "item", ...}，最后一行是整批的汇总 {"type": "summary", ...}"""
+    async for item in job.results():
+        yield ndjson({"type": "item", **item.to_dict(with_result=True)})
+    yield ndjson({"type": "summary", **job.progress()})
+
+@app.post("/batch")
+async def batch_endpoint(req: BatchRequest):
+    if not req.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"单批最多 {BATCH_MAX_ITEMS} 项")
+    
+    job = batch_runner.submit(req.items, write_file=req.output == "file")
+    if req.output == "file":
+        return JSONResponse(status_code=202, content=job.progress())
+    # 客户端中途断开不影响任务本身，之后可以用 /batch/{job_id}/results 接着拿
+    return StreamingResponse(batch_stream(job), media_type="application/x-ndjson", headers={"X-Batch-Id": job.id})
+
+@app.get("/batch/{job_id}")
+def batch_status_endpoint(job_id: str, items: bool = False):
+    """整批进度；?items=true 附带每一项的状态"""
+    job = batch_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="批量任务不存在")
+    return job.progress(with_items=items)
+
+@app.get("/batch/{job_id}/results")
+async def batch_results_endpoint(job_id: str):
+    """已完成的结果 (NDJSON)，任务没结束就一直跟随到结束"""
+    job = batch_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="批量任务不存在")
+    return StreamingResponse(batch_stream(job), media_type="application/x-ndjson", headers={"X-Batch-Id": job.id})
+
+def _jsonable(event: dict, transport_mode: str, city: str = None) -> dict:
+    """
+    DayPlan 对象转成普通 dict，方便序列化 (顺便补上这一天的坐标和路线)
+    坐标不在推流里现查：segment 一到就后台预取，day 事件只用缓存里已有的，
+    最后 done 事件里的完整行程再补齐剩下的 (那时基本都已预取好)
+    """
+    if event["type"] == "segment":
+        segment = event.get("segment") or {}
+        if segment.get("type") == "place" and segment.get("name"):
+            get_geocoder().prefetch([(segment["name"], city)])
+    elif event["type"] == "day":
+        enrich_days([event["plan"]], city, transport_mode, fetch=False)
+        return {**event, "plan": event["plan"].model_dump()}
+    return event
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,108 @@
+# backend/replay.py
+"""
+录制 / 回放场景 (和 test_graph.py 一样直接跑 Graph，不经过 HTTP)
+
+录制 (需要真实的 API Key)：
+    python replay.py record --cassette cassettes/hamilton.jsonl.gz
+回放 (完全离线)：
+    python replay.py replay --cassette cassettes/hamilton.jsonl.gz             # 立即返回，只测我们自己的开销
+    python replay.py replay --cassette cassettes/hamilton.jsonl.gz --latency 1 # 按录制时的上游耗时等待
+
+场景文件 (--scenarios) 是 JSON 数组，每个场景是同一会话里依次发送的几句话：
+    [{"name": "hamilton", "messages": ["我想去 Hamilton 玩两天...", "把第二天下午换成购物"]}]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+DEFAULT_SCENARIOS = [
+    {
+        "name": "hamilton_weekend",
+        "messages": ["我想去 Hamilton 玩两天，这周末去，喜欢看自然风光和吃tacos", "把第二天下午换成购物"],
+    },
+    {
+        "name": "weather_question",
+        "messages": ["明天 Hamilton 天气怎么样？"],
+    },
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="录制 / 回放 LLM 与工具调用")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", default="./cassette.jsonl.gz", help="磁带文件")
+    parser.add_argument("--scenarios", help="场景文件 (JSON)，默认用内置的 test_graph 场景")
+    parser.add_argument("--latency", type=float, default=0.0, help="回放耗时倍数 (0 = 立即返回)")
+    parser.add_argument("--strict", action="store_true", help="请求必须和录制时完全一致")
+    parser.add_argument("--report", help="把每一轮的耗时写成 JSON，方便对比两个版本")
+    return parser.parse_args()
+
+def run_turn(message: str, session_id: str, continuing: bool) -> dict:
+    """和 /chat 一样：新请求先分类，续聊一定走完整 Graph"""
+    from langchain_core.messages import HumanMessage
+    from app.agents.graph import graph
+    from app.agents.checkpoint import session_config
+    from app.agents.router import classify_request, ROUTE_FAST, ROUTE_FULL
+    from app.agents.fast_path import run_fast_path
+    from app.agents.artifacts import artifacts
+
+    route = ROUTE_FULL if continuing else classify_request(message)
+    if route == ROUTE_FAST:
+        return {"route": route, "reply": run_fast_path(message)}
+    final_state = graph.invoke({"messages": [HumanMessage(content=message)]}, session_config(session_id))
+    return {"route": route, "reply": artifacts.resolve(final_state.get("draft_plan")) or "", "followup": final_state.get("followup_type")}
+
+def main():
+    args = parse_args()
+
+    # 这些配置在 app 模块导入时读取，所以要先设好
+    os.environ["CASSETTE_MODE"] = args.mode
+    os.environ["CASSETTE_PATH"] = args.cassette
+    os.environ["CASSETTE_LATENCY"] = str(args.latency)
+    os.environ["CASSETTE_STRICT"] = "true" if args.strict else "false"
+    # 会话、缓存、Artifact 都用一次性的内存版：每次运行从同样的初始状态开始
+    os.environ.setdefault("SESSION_DB_PATH", ":memory:")
+    os.environ.setdefault("CACHE_BACKEND", "memory")
+    os.environ.setdefault("ARTIFACT_DB_PATH", ":memory:")
+
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(usecwd=True))
+    from app.services.cassette import cassette, CassetteMiss
+
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios, encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    report, failed = [], 0
+    for scenario in scenarios:
+        session_id = uuid.uuid4().hex
+        for turn, message in enumerate(scenario["messages"]):
+            started = time.perf_counter()
+            try:
+                result = run_turn(message, session_id, continuing=turn > 0)
+                status = "ok"
+            except CassetteMiss as e:
+                result, status = {"error": str(e)}, "miss"
+                failed += 1
+            elapsed = time.perf_counter() - started
+            report.append({"scenario": scenario["name"], "turn": turn, "status": status,
+                           "route": result.get("route"), "seconds": round(elapsed, 3)})
+            print(f"[{status}] {scenario['name']}#{turn} {result.get('route') or '-'} {elapsed:.3f}s")
+
+    total = sum(r["seconds"] for r in report)
+    print(f"共 {len(report)} 轮，总耗时 {total:.3f}s，失败 {failed} 轮")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"mode": args.mode, "cassette": args.cassette, "latency": args.latency, "turns": report},
+                      f, ensure_ascii=False, indent=2)
+
+    if args.mode == "record":
+        cassette.save()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
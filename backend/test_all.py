@@ -93,6 +93,29 @@ def test_langsmith():
     else:
         print("⚠️ [LangSmith]: 跳过 (未开启 Tracing，调试时可能看不到流程图)")
 
+def test_router():
+    """检查复杂度路由的规则 (不调用 LLM)：None 表示规则拿不准，交给小模型"""
+    from app.agents.router import classify_by_rules, ROUTE_FAST, ROUTE_FULL
+
+    cases = [
+        ("明天 Hamilton 天气怎么样？", ROUTE_FAST),
+        ("What time does the CN Tower open?", ROUTE_FAST),
+        ("帮我规划 Hamilton 三天的行程", ROUTE_FULL),
+        # 曾经的误判：英文关键词是别的单词的一部分
+        ("Going to Copenhagen with my family next month, what should we do?", None),
+        ("Plan a 3 day trip to Toronto by train", ROUTE_FULL),
+        ("Any snowboarding spots near Whistler for a weekend plan?", ROUTE_FULL),
+        ("How long is the train from Toronto to Niagara?", None),
+        # "plan" 只算整词 (plans/planning/planned)，plane、planet 不算
+        ("Which plane goes to Vancouver tomorrow?", None),
+        ("Is the planetarium open on Monday?", ROUTE_FAST),
+    ]
+    wrong = [(message, expected, classify_by_rules(message)) for message, expected in cases
+             if classify_by_rules(message) != expected]
+    for message, expected, actual in wrong:
+        print(f"   {message!r}: 期望 {expected}，实际 {actual}")
+    print_result("Router", not wrong, f"{len(cases) - len(wrong)}/{len(cases)} 条规则用例通过")
+
 if __name__ == "__main__":
     print("------ 开始全栈环境自检 ------")
     test_gemini()
@@ -100,4 +123,5 @@ if __name__ == "__main__":
     test_milvus()
     test_openweather()
     test_langsmith()
+    test_router()
     print("----------------------------")
\ No newline at end of file
@@ -1,5 +1,8 @@
 # backend/test_graph.py
+import uuid
 from app.agents.graph import graph
+from app.agents.checkpoint import session_config
+from app.agents.artifacts import artifacts
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv, find_dotenv
 
@@ -16,13 +19,25 @@ if __name__ == "__main__":
     
     # 使用 invoke 直接运行到结束，并获取最终状态
     # (相比 stream，invoke 更适合拿最终结果)
-    final_state = graph.invoke(initial_state)
+    # Graph 挂了 checkpointer，每次测试用一个新会话
+    config = session_config(uuid.uuid4().hex)
+    final_state = graph.invoke(initial_state, config)
     
     print("\n" + "="*30)
     print("🌟 最终生成的旅行计划 🌟")
     print("="*30 + "\n")
     
     # 打印最终的草稿
-    print(final_state.get("draft_plan", "❌ 生成失败，未找到行程草稿"))
+    # State 里存的是草稿的引用，取出正文再打印
+    print(artifacts.resolve(final_state.get("draft_plan")) or "❌ 生成失败，未找到行程草稿")
+    
+    print("\n" + "="*30)
+    
+    # 多轮修改：同一个会话里追加一句，应只重跑规划师
+    followup_input = "把第二天下午换成购物"
+    print(f"\n✏️ 续聊修改: {followup_input}\n")
+    final_state = graph.invoke({"messages": [HumanMessage(content=followup_input)]}, config)
+    print(f"续聊类型: {final_state.get('followup_type')}\n")
+    print(artifacts.resolve(final_state.get("draft_plan")) or "❌ 修改失败")
     
     print("\n" + "="*30)
\ No newline at end of file
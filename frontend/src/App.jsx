@@ -1,6 +1,5 @@
 // frontend/src/App.jsx
 import { useState, useEffect } from 'react'
-import axios from 'axios'
 import ReactMarkdown from 'react-markdown'
 import DatePicker from 'react-datepicker'
 import { Country, State, City } from 'country-state-city' // 📦 地理数据
@@ -8,6 +7,28 @@ import { format } from 'date-fns' // 📅 日期格式化
 import "react-datepicker/dist/react-datepicker.css" // 引入日历样式
 import './App.css'
 
+// 解析一条 SSE 事件 ("event: xxx\ndata: {...}")
+function parseSSE(raw) {
+  let event = 'message'
+  let data = ''
+  for (const line of raw.split('\n')) {
+    if (line.startsWith('event: ')) event = line.slice(7)
+    else if (line.startsWith('data: ')) data += line.slice(6)
+  }
+  return { event, data: data ? JSON.parse(data) : null }
+}
+
+// 单日行程 -> Markdown (和后端 plan_to_markdown 保持一致)
+function dayToMarkdown(day) {
+  const lines = [`## 第 ${day.day_index} 天 · ${day.date}`]
+  if (day.weather) lines.push(`🌤️ ${day.weather.condition} ${day.weather.temp}`)
+  for (const spot of day.attractions) lines.push(`- **${spot.name}** (${spot.visit_duration} 分钟): ${spot.description}`)
+  for (const meal of day.meals) lines.push(`- 🍽️ ${meal.type}: ${meal.name}`)
+  if (day.hotel) lines.push(`- 🏨 住宿: ${day.hotel.name} (${day.hotel.price_range})`)
+  lines.push('', day.daily_summary, '')
+  return lines.join('\n')
+}
+
 function App() {
   // --- 1. 结构化表单状态 ---
   const [selectedCountry, setSelectedCountry] = useState(null)
@@ -61,18 +82,52 @@ function App() {
     const displayMsg = `📅 计划：${formattedStart} 至 ${formattedEnd} \n📍 目的地：${locationStr} \n❤️ 偏好：${interests || '无'}`
     setMessages(prev => [...prev, { role: 'user', content: displayMsg }])
 
+    // 先放一条空的 AI 消息，后面逐天往里填
+    setMessages(prev => [...prev, { role: 'ai', content: '' }])
+    const updateLastAiMsg = (content) => setMessages(prev => [...prev.slice(0, -1), { role: 'ai', content }])
+
     try {
-      const response = await axios.post('http://localhost:8000/chat', {
-        message: userPrompt
+      // 🌊 流式接口：每生成完一天就推过来，不用等整份行程
+      const response = await fetch('http://localhost:8000/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: userPrompt })
       })
+      if (!response.ok) throw new Error(`HTTP ${response.status}`)
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let days = []
+
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
 
-      const aiMsg = { role: 'ai', content: response.data.reply }
-      setMessages(prev => [...prev, aiMsg])
-      setDebugInfo(response.data.details)
+        // SSE 以空行分隔每条事件
+        const events = buffer.split('\n\n')
+        buffer = events.pop()
+        for (const raw of events) {
+          const { event, data } = parseSSE(raw)
+          if (event === 'reset') {
+            days = []
+            updateLastAiMsg('')
+          } else if (event === 'day') {
+            days = [...days, dayToMarkdown(data.plan)]
+            updateLastAiMsg(days.join('\n') + '\n⏳ 继续生成中...')
+          } else if (event === 'done') {
+            updateLastAiMsg(data.reply)
+            setDebugInfo(data.details)
+          } else if (event === 'error') {
+            throw new Error(data.detail)
+          }
+        }
+      }
 
     } catch (error) {
       console.error(error)
-      setMessages(prev => [...prev, { role: 'ai', content: '❌ 请求失败，请检查后端。' }])
+      updateLastAiMsg('❌ 请求失败，请检查后端。')
     } finally {
       setLoading(false)
     }